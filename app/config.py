@@ -2,7 +2,10 @@
 import os
 from dotenv import load_dotenv
 
-load_dotenv()
+# Railway'da o'zgaruvchilar platformaning o'zidan keladi — .env faylni
+# o'qish/parse qilish shart emas. Lokal ishga tushirishda .env yuklanadi.
+if os.getenv("RAILWAY_ENVIRONMENT") is None:
+    load_dotenv()
 
 APP_MODE = os.getenv("APP_MODE", "all_in_one").strip().lower()
 
@@ -34,12 +37,18 @@ TASDIQ_STORE_NAME = os.getenv("TASDIQ_STORE_NAME", "Abusahiy 75").strip()
 
 # Adminlar (Telegram user ID), vergul bilan: 123,456
 ADMIN_IDS_RAW = os.getenv("ADMIN_IDS", "").strip()
-ADMIN_IDS = [int(x) for x in ADMIN_IDS_RAW.split(",") if x.strip().isdigit()]
+ADMIN_IDS = frozenset(int(x) for x in ADMIN_IDS_RAW.split(",") if x.strip().isdigit())
 
 # Google Cloud Vision (service account JSON content)
 GCP_SA_JSON = os.getenv("GCP_SA_JSON", "").strip()
 VISION_ENABLED = os.getenv("VISION_ENABLED", "1").strip().lower() in ("1", "true", "yes", "on")
 
+# Operator parollari hash kaliti (blake2b key, max 64 bayt)
+PASSWORD_SALT = os.getenv("PASSWORD_SALT", "").strip()
+
+if not PASSWORD_SALT:
+    raise RuntimeError("PASSWORD_SALT topilmadi. Railway yoki .env ga kiriting.")
+
 if not BOT_TOKEN:
     raise RuntimeError(
         "Bot token topilmadi. "
@@ -1,39 +1,212 @@
 # app/db.py
 import sqlite3
-import json
 import os
+import re
+import hashlib
+import hmac
+import atexit
+import threading
 from pathlib import Path
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, NamedTuple, Tuple
+
+import orjson
+
+from .config import PASSWORD_SALT
 
 DB_PATH = Path(__file__).parent / "storage" / "app.db"
 
+_NON_DIGITS_RE = re.compile(r"\D+")
+
+# Parol ochiq saqlanmaydi: blake2b (16 bayt). Kalit ENV dan (config da majburiy),
+# o'zgartirilsa mavjud operatorlar qayta login qila olmaydi.
+_PASSWORD_KEY = PASSWORD_SALT.encode()[:64]
+
+# Bitta umumiy ulanish: har chaqiruvda connect/close qilinmaydi.
+# Handlerlar executor threadlarida ham ishlashi mumkin, shuning uchun
+# yozuvchi amallar _LOCK bilan ketma-ket bajariladi.
+_CONN: Optional[sqlite3.Connection] = None
+_LOCK = threading.RLock()
+_INITIALIZED = False
+
+# WAL: har commit to'liq fsync emas, o'qishlar yozuvchini bloklamaydi
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA mmap_size=134217728",
+)
+
+
+def _apply_pragmas(conn: sqlite3.Connection) -> None:
+    for stmt in _PRAGMAS:
+        conn.execute(stmt)
+
+
+def get_conn() -> sqlite3.Connection:
+    global _CONN
+    if _CONN is None:
+        with _LOCK:
+            if _CONN is None:
+                DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+                conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=256)
+                _apply_pragmas(conn)
+                atexit.register(conn.close)
+                _CONN = conn
+    return _CONN
+
+
+# ---------------- SQL ----------------
+# So'rov matnlari modul darajasida: sqlite3 statement cache har safar
+# aynan shu string bilan uriladi va qayta parse qilinmaydi.
+
+_SQL_INSERT_OPERATOR = "INSERT INTO operators (phone, name, password_hash) VALUES (?, ?, ?)"
+_SQL_SEED_OPERATOR = "INSERT OR IGNORE INTO operators (phone, name, password_hash) VALUES (?, ?, ?)"
+_SQL_CHECK_OPERATOR = "SELECT id, phone, name, created_at, password_hash FROM operators WHERE phone=?"
+_SQL_LIST_OPERATORS = "SELECT id, phone, name, created_at FROM operators ORDER BY id DESC LIMIT ? OFFSET ?"
+_SQL_LIST_OPERATORS_WITH_TOTAL = (
+    "SELECT id, phone, name, created_at, COUNT(*) OVER () AS total "
+    "FROM operators ORDER BY id DESC LIMIT ? OFFSET ?"
+)
+_SQL_COUNT_OPERATORS = "SELECT COUNT(1) AS c FROM operators"
+_SQL_DELETE_OPERATOR = "DELETE FROM operators WHERE phone=?"
+
+_SQL_INSERT_CONFIRM = """
+INSERT INTO confirms (operator_id, brand, client_name, phone_plus, counterparty_meta, status)
+VALUES (?, ?, ?, ?, ?, 'OPEN')
+"""
+
+_SQL_UPSERT_CONFIRM = """
+UPDATE confirms
+SET client_name=?,
+    counterparty_meta=?
+WHERE id=(
+    SELECT id
+    FROM confirms
+    WHERE operator_id=?
+      AND status='OPEN'
+      AND upper(trim(brand))=?
+      AND trim(phone_plus)=?
+    ORDER BY id DESC
+    LIMIT 1
+)
+RETURNING id
+"""
+
+_SQL_LIST_OPEN_CONFIRMS = """
+SELECT id, brand, COALESCE(client_name,''), COALESCE(phone_plus,''), created_at
+FROM confirms
+WHERE operator_id=? AND status='OPEN'
+ORDER BY id DESC
+LIMIT ?
+"""
+
+_SQL_SEARCH_OPEN_CONFIRMS = """
+SELECT id, brand, COALESCE(client_name,''), COALESCE(phone_plus,''), created_at
+FROM confirms
+WHERE operator_id=? AND status='OPEN'
+  AND LOWER(
+    COALESCE(brand,'') || '|' || COALESCE(client_name,'') || '|' || COALESCE(phone_plus,'')
+  ) LIKE ?
+ORDER BY id DESC
+LIMIT ?
+"""
+
+_SQL_GET_CONFIRM = """
+SELECT id, brand, client_name, phone_plus, counterparty_meta, status, created_at
+FROM confirms
+WHERE operator_id=? AND id=?
+LIMIT 1
+"""
+
+_SQL_MARK_CONFIRM_DONE = """
+UPDATE confirms
+SET status='DONE', done_at=datetime('now')
+WHERE operator_id=? AND id=? AND status='OPEN'
+RETURNING id, brand, phone_plus
+"""
+
+_SQL_LATEST_OPEN_CONFIRM = """
+SELECT id, brand, client_name, phone_plus, counterparty_meta, status, created_at
+FROM confirms
+WHERE operator_id=? AND status='OPEN'
+ORDER BY id DESC
+LIMIT 1
+"""
+
+
+class Operator(NamedTuple):
+    id: int
+    phone: str
+    name: str
+    created_at: str
+
+
+class ConfirmHeader(NamedTuple):
+    # counterparty_meta siz: ro'yxat/qidiruv tugmalari uchun JSON kerak emas.
+    # Matn maydonlari SQL da COALESCE qilingan — hech qachon None emas
+    id: int
+    brand: str
+    client_name: str
+    phone_plus: str
+    created_at: str
+
+
+def _hash_password(password: str) -> bytes:
+    return hashlib.blake2b(password.encode(), digest_size=16, key=_PASSWORD_KEY).digest()
+
+
+def _migrate_plain_passwords(cur: sqlite3.Cursor) -> None:
+    """
+    Eski bazalar: ochiq `password` ustunini password_hash ga o'tkazib,
+    keyin o'chiradi. Yangi bazada hech narsa qilmaydi.
+    """
+    cols = {r[1] for r in cur.execute("PRAGMA table_info(operators)")}
+    if "password" not in cols:
+        return
 
-def get_conn():
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    if "password_hash" not in cols:
+        cur.execute("ALTER TABLE operators ADD COLUMN password_hash BLOB")
 
+    rows = cur.execute("SELECT id, password FROM operators WHERE password_hash IS NULL").fetchall()
+    cur.executemany(
+        "UPDATE operators SET password_hash=? WHERE id=?",
+        [(_hash_password(pwd or ""), oid) for oid, pwd in rows],
+    )
+    cur.execute("ALTER TABLE operators DROP COLUMN password")
 
-def _loads_meta(raw: str) -> Dict[str, Any]:
+
+def _dumps_meta(meta: Dict[str, Any]) -> bytes:
+    # BLOB sifatida saqlanadi: orjson darrov UTF-8 bytes qaytaradi
+    return orjson.dumps(meta or {})
+
+
+def _loads_meta(raw) -> Dict[str, Any]:
+    # eski yozuvlar TEXT, yangilari BLOB — orjson ikkalasini ham qabul qiladi
     try:
-        return json.loads(raw or "{}")
+        return orjson.loads(raw or b"{}")
     except Exception:
         return {}
 
 
-def _row_to_confirm_dict(r: sqlite3.Row) -> Dict[str, Any]:
+def _row_to_confirm_full_dict(r: tuple) -> Dict[str, Any]:
+    cid, brand, client_name, phone_plus, meta, status, created_at = r
     return {
-        "id": int(r["id"]),
-        "brand": r["brand"],
-        "client_name": r["client_name"],
-        "phone_plus": r["phone_plus"],
-        "counterparty_meta": _loads_meta(r["counterparty_meta"]),
-        "created_at": r["created_at"],
+        "id": int(cid),
+        "brand": brand,
+        "client_name": client_name,
+        "phone_plus": phone_plus,
+        "counterparty_meta": _loads_meta(meta),
+        "status": status,
+        "created_at": created_at,
     }
 
 
 def init_db():
+    global _INITIALIZED
+    if _INITIALIZED:
+        return
+
     conn = get_conn()
     cur = conn.cursor()
 
@@ -43,11 +216,13 @@ def init_db():
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         phone TEXT UNIQUE NOT NULL,
         name TEXT NOT NULL,
-        password TEXT NOT NULL,
+        password_hash BLOB NOT NULL,
         created_at TEXT DEFAULT (datetime('now'))
     )
     """)
 
+    _migrate_plain_passwords(cur)
+
     # confirms
     cur.execute("""
     CREATE TABLE IF NOT EXISTS confirms (
@@ -72,16 +247,22 @@ def init_db():
         "CREATE INDEX IF NOT EXISTS idx_confirms_operator_brand_phone_status "
         "ON confirms(operator_id, brand, phone_plus, status)"
     )
+    # create_confirm_upsert qidiruvi upper(trim(brand)) / trim(phone_plus)
+    # bo'yicha ketadi, oddiy ustun indeksi unga ishlamaydi
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_confirms_upsert "
+        "ON confirms(operator_id, status, upper(trim(brand)), trim(phone_plus), id DESC)"
+    )
     cur.execute(
         "CREATE INDEX IF NOT EXISTS idx_confirms_created_at "
         "ON confirms(created_at)"
     )
 
     conn.commit()
-    conn.close()
 
     # Railway ENV dan operatorlar seed qilinadi
     seed_operators_from_env()
+    _INITIALIZED = True
 
 
 # ---------------- OPERATORS SEED ----------------
@@ -98,7 +279,7 @@ def seed_operators_from_env() -> int:
     if not raw:
         return 0
 
-    added = 0
+    rows = []
     items = [x.strip() for x in raw.split(";") if x.strip()]
 
     for item in items:
@@ -107,85 +288,112 @@ def seed_operators_from_env() -> int:
             continue
 
         phone, name, password = cols[0], cols[1], cols[2]
-        phone = "".join(ch for ch in phone if ch.isdigit())
+        phone = _NON_DIGITS_RE.sub("", phone)
         if not phone:
             continue
 
-        ok = create_operator(phone, name, password)
-        if ok:
-            added += 1
+        rows.append((phone, name, _hash_password(password)))
 
-    return added
+    if not rows:
+        return 0
+
+    # bitta tranzaksiya: mavjud telefonlar OR IGNORE bilan o'tkazib yuboriladi
+    conn = get_conn()
+    with _LOCK:
+        cur = conn.cursor()
+        cur.executemany(_SQL_SEED_OPERATOR, rows)
+        conn.commit()
+        _OP_CACHE.clear()
+        return max(0, cur.rowcount)
 
 
 # ---------------- operators ----------------
+# Eslatma: operator/confirm helperlari tozalangan (strip qilingan) satr kutadi,
+# normalizatsiya handlerlarda bir marta qilinadi.
 
 def create_operator(phone: str, name: str, password: str) -> bool:
+    conn = get_conn()
+    with _LOCK:
+        cur = conn.cursor()
+        try:
+            cur.execute(_SQL_INSERT_OPERATOR, (phone, name, _hash_password(password)))
+            conn.commit()
+            _OP_CACHE.clear()
+            return True
+        except sqlite3.IntegrityError:
+            conn.rollback()
+            return False
+
+
+# Qayta login (restart/timeout) uchun xotiradagi kesh; kalitda faqat hash turadi.
+# Faqat muvaffaqiyatli loginlar saqlanadi (xato urinishlar keshni to'ldirmaydi),
+# operators jadvaliga har yozuvdan keyin tozalanadi.
+_OP_CACHE: Dict[Tuple[str, bytes], Operator] = {}
+_OP_CACHE_MAX = 128
+
+
+def check_operator(phone: str, password: str) -> Optional[Operator]:
+    key = (phone, _hash_password(password))
+    op = _OP_CACHE.get(key)
+    if op is not None:
+        return op
+    op = _lookup_operator(*key)
+    if op is not None:
+        with _LOCK:
+            if len(_OP_CACHE) >= _OP_CACHE_MAX:
+                _OP_CACHE.pop(next(iter(_OP_CACHE)))
+            _OP_CACHE[key] = op
+    return op
+
+
+def _lookup_operator(phone: str, password_hash: bytes) -> Optional[Operator]:
     conn = get_conn()
     cur = conn.cursor()
-    try:
-        cur.execute(
-            "INSERT INTO operators (phone, name, password) VALUES (?, ?, ?)",
-            ((phone or "").strip(), (name or "").strip(), (password or "").strip())
-        )
-        conn.commit()
-        return True
-    except sqlite3.IntegrityError:
-        return False
-    finally:
-        conn.close()
+    cur.execute(_SQL_CHECK_OPERATOR, (phone,))
+    row = cur.fetchone()
+    # hash SQL da emas, constant-time solishtiriladi
+    if not row or not hmac.compare_digest(bytes(row[4] or b""), password_hash):
+        return None
+    return Operator._make(row[:4])
 
 
-def check_operator(phone: str, password: str):
+def list_operators(limit: int = 50, offset: int = 0) -> List[Operator]:
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute(
-        "SELECT id, phone, name FROM operators WHERE phone=? AND password=?",
-        ((phone or "").strip(), (password or "").strip())
-    )
-    row = cur.fetchone()
-    conn.close()
-    return row
+    cur.execute(_SQL_LIST_OPERATORS, (int(limit), int(offset)))
+    return list(map(Operator._make, cur.fetchall()))
 
 
-def list_operators(limit: int = 200) -> List[Dict[str, Any]]:
+def list_operators_with_total(limit: int = 50, offset: int = 0) -> Tuple[List[Operator], int]:
+    """
+    Sahifa + jami operatorlar soni bitta so'rovda (COUNT(*) OVER ()).
+    Sahifa bo'sh bo'lsa jami 0 qaytadi.
+    """
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute(
-        "SELECT id, phone, name, created_at FROM operators ORDER BY id DESC LIMIT ?",
-        (int(limit),),
-    )
+    cur.execute(_SQL_LIST_OPERATORS_WITH_TOTAL, (int(limit), int(offset)))
     rows = cur.fetchall()
-    conn.close()
-
-    return [
-        {
-            "id": int(r["id"]),
-            "phone": r["phone"],
-            "name": r["name"],
-            "created_at": r["created_at"],
-        }
-        for r in rows
-    ]
+    if not rows:
+        return [], 0
+    return [Operator._make(r[:4]) for r in rows], int(rows[0][4])
 
 
 def count_operators() -> int:
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute("SELECT COUNT(1) AS c FROM operators")
+    cur.execute(_SQL_COUNT_OPERATORS)
     row = cur.fetchone()
-    conn.close()
-    return int(row["c"] if row else 0)
+    return int(row[0] if row else 0)
 
 
 def delete_operator_by_phone(phone: str) -> bool:
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM operators WHERE phone=?", ((phone or "").strip(),))
-    conn.commit()
-    deleted = cur.rowcount > 0
-    conn.close()
-    return deleted
+    with _LOCK:
+        cur = conn.cursor()
+        cur.execute(_SQL_DELETE_OPERATOR, (phone,))
+        conn.commit()
+        _OP_CACHE.clear()
+        return cur.rowcount > 0
 
 
 # ---------------- confirms ----------------
@@ -200,28 +408,17 @@ def create_confirm(
     """
     Oddiy insert: har safar yangi OPEN yozadi.
     """
-    conn = get_conn()
-    cur = conn.cursor()
-
-    meta_json = json.dumps(counterparty_meta or {}, ensure_ascii=False)
+    meta_blob = _dumps_meta(counterparty_meta)
 
-    cur.execute(
-        """
-        INSERT INTO confirms (operator_id, brand, client_name, phone_plus, counterparty_meta, status)
-        VALUES (?, ?, ?, ?, ?, 'OPEN')
-        """,
-        (
-            int(operator_id),
-            (brand or "").strip(),
-            (client_name or "").strip(),
-            (phone_plus or "").strip(),
-            meta_json,
-        ),
-    )
-    conn.commit()
-    new_id = int(cur.lastrowid)
-    conn.close()
-    return new_id
+    conn = get_conn()
+    with _LOCK:
+        cur = conn.cursor()
+        cur.execute(
+            _SQL_INSERT_CONFIRM,
+            (int(operator_id), brand, client_name, phone_plus, meta_blob),
+        )
+        conn.commit()
+        return int(cur.lastrowid)
 
 
 def create_confirm_upsert(
@@ -242,169 +439,84 @@ def create_confirm_upsert(
       - yangi OPEN yaratadi
     """
     op_id = int(operator_id or 0)
-    brand_key = (brand or "").strip().upper()
-    phone_key = (phone_plus or "").strip()
-    client_clean = (client_name or "").strip()
-    meta_json = json.dumps(counterparty_meta or {}, ensure_ascii=False)
+    brand_key = brand.upper()
+    meta_blob = _dumps_meta(counterparty_meta)
 
-    if not op_id or not brand_key or not phone_key:
+    if not op_id or not brand_key or not phone_plus:
         return create_confirm(operator_id, brand, client_name, phone_plus, counterparty_meta)
 
     conn = get_conn()
-    cur = conn.cursor()
-
-    cur.execute(
-        """
-        SELECT id
-        FROM confirms
-        WHERE operator_id=?
-          AND status='OPEN'
-          AND upper(trim(brand))=?
-          AND trim(phone_plus)=?
-        ORDER BY id DESC
-        LIMIT 1
-        """,
-        (op_id, brand_key, phone_key),
-    )
-    row = cur.fetchone()
-
-    if row:
-        existing_id = int(row["id"])
-        cur.execute(
-            """
-            UPDATE confirms
-            SET client_name=?,
-                counterparty_meta=?
-            WHERE operator_id=? AND id=? AND status='OPEN'
-            """,
-            (client_clean, meta_json, op_id, existing_id),
-        )
+    with _LOCK:
+        cur = conn.cursor()
+        # SELECT + UPDATE bitta so'rovda: mos OPEN bo'lsa yangilanadi va id qaytadi
+        cur.execute(_SQL_UPSERT_CONFIRM, (client_name, meta_blob, op_id, brand_key, phone_plus))
+        row = cur.fetchone()
         conn.commit()
-        conn.close()
-        return existing_id
 
-    conn.close()
-    return create_confirm(op_id, brand_key, client_clean, phone_key, counterparty_meta)
+        if row:
+            return int(row[0])
 
+        return create_confirm(op_id, brand_key, client_name, phone_plus, counterparty_meta)
 
-def list_open_confirms(operator_id: int, limit: int = 20) -> List[Dict[str, Any]]:
+
+def list_open_confirms(operator_id: int, limit: int = 20) -> List[ConfirmHeader]:
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT id, brand, client_name, phone_plus, counterparty_meta, created_at
-        FROM confirms
-        WHERE operator_id=? AND status='OPEN'
-        ORDER BY id DESC
-        LIMIT ?
-        """,
-        (int(operator_id), int(limit)),
-    )
+    cur.execute(_SQL_LIST_OPEN_CONFIRMS, (int(operator_id), int(limit)))
     rows = cur.fetchall()
-    conn.close()
 
-    return [_row_to_confirm_dict(r) for r in rows]
+    return list(map(ConfirmHeader._make, rows))
 
 
-def search_open_confirms(operator_id: int, q: str, limit: int = 20) -> List[Dict[str, Any]]:
+def search_open_confirms(operator_id: int, q: str, limit: int = 20) -> List[ConfirmHeader]:
     conn = get_conn()
     cur = conn.cursor()
 
     like = f"%{(q or '').lower()}%"
 
     cur.execute(
-        """
-        SELECT id, brand, client_name, phone_plus, counterparty_meta, created_at
-        FROM confirms
-        WHERE operator_id=? AND status='OPEN'
-          AND (
-            LOWER(COALESCE(brand,'')) LIKE ?
-            OR LOWER(COALESCE(client_name,'')) LIKE ?
-            OR LOWER(COALESCE(phone_plus,'')) LIKE ?
-          )
-        ORDER BY id DESC
-        LIMIT ?
-        """,
-        (int(operator_id), like, like, like, int(limit)),
+        _SQL_SEARCH_OPEN_CONFIRMS,
+        (int(operator_id), like, int(limit)),
     )
 
     rows = cur.fetchall()
-    conn.close()
 
-    return [_row_to_confirm_dict(r) for r in rows]
+    return list(map(ConfirmHeader._make, rows))
 
 
 def get_confirm(operator_id: int, confirm_id: int) -> Optional[Dict[str, Any]]:
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT id, brand, client_name, phone_plus, counterparty_meta, status, created_at
-        FROM confirms
-        WHERE operator_id=? AND id=?
-        LIMIT 1
-        """,
-        (int(operator_id), int(confirm_id)),
-    )
+    cur.execute(_SQL_GET_CONFIRM, (int(operator_id), int(confirm_id)))
     r = cur.fetchone()
-    conn.close()
 
     if not r:
         return None
 
-    return {
-        "id": int(r["id"]),
-        "brand": r["brand"],
-        "client_name": r["client_name"],
-        "phone_plus": r["phone_plus"],
-        "counterparty_meta": _loads_meta(r["counterparty_meta"]),
-        "status": r["status"],
-        "created_at": r["created_at"],
-    }
+    return _row_to_confirm_full_dict(r)
 
 
-def mark_confirm_done(operator_id: int, confirm_id: int) -> bool:
+def mark_confirm_done(operator_id: int, confirm_id: int) -> Optional[Tuple[int, str, str]]:
+    """
+    OPEN -> DONE. Yopilgan yozuvning (id, brand, phone_plus) qaytadi,
+    hech narsa yangilanmasa None (qo'shimcha SELECT shart emas).
+    """
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        UPDATE confirms
-        SET status='DONE', done_at=datetime('now')
-        WHERE operator_id=? AND id=? AND status='OPEN'
-        """,
-        (int(operator_id), int(confirm_id)),
-    )
-    conn.commit()
-    changed = cur.rowcount > 0
-    conn.close()
-    return changed
+    with _LOCK:
+        cur = conn.cursor()
+        cur.execute(_SQL_MARK_CONFIRM_DONE, (int(operator_id), int(confirm_id)))
+        row = cur.fetchone()
+        conn.commit()
+        return row
 
 
 def get_latest_open_confirm(operator_id: int) -> Optional[Dict[str, Any]]:
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT id, brand, client_name, phone_plus, counterparty_meta, status, created_at
-        FROM confirms
-        WHERE operator_id=? AND status='OPEN'
-        ORDER BY id DESC
-        LIMIT 1
-        """,
-        (int(operator_id),),
-    )
+    cur.execute(_SQL_LATEST_OPEN_CONFIRM, (int(operator_id),))
     r = cur.fetchone()
-    conn.close()
 
     if not r:
         return None
 
-    return {
-        "id": int(r["id"]),
-        "brand": r["brand"],
-        "client_name": r["client_name"],
-        "phone_plus": r["phone_plus"],
-        "counterparty_meta": _loads_meta(r["counterparty_meta"]),
-        "status": r["status"],
-        "created_at": r["created_at"],
-    }
\ No newline at end of file
+    return _row_to_confirm_full_dict(r)
\ No newline at end of file
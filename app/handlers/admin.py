@@ -1,4 +1,7 @@
 # app/handlers/admin.py
+import asyncio
+import functools
+import os
 import re
 import secrets
 import string
@@ -6,14 +9,35 @@ from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboard
 from telegram.ext import ContextTypes, ConversationHandler
 
 from ..config import ADMIN_IDS
-from ..db import create_operator, list_operators, count_operators, delete_operator_by_phone
+from ..db import create_operator, list_operators_with_total, count_operators, delete_operator_by_phone
 
 AD_MENU, AD_ADD_PHONE, AD_ADD_NAME, AD_ADD_PASS, AD_DEL_PHONE = range(5)
 
+_NON_DIGITS_RE = re.compile(r"\D+")
 
-def _is_admin(update: Update) -> bool:
-    uid = getattr(update.effective_user, "id", None)
-    return uid in ADMIN_IDS
+
+_NO_ACCESS_TEXT = "❌ Sizda admin huquqi yo‘q."
+
+
+def admin_only(fn):
+    """
+    Admin tekshiruvi bitta joyda: admin bo'lmasa xabar yuborib suhbatni yopadi.
+    Callback (inline tugma) va oddiy xabar ikkalasini ham qo'llaydi.
+    """
+    @functools.wraps(fn)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user = update.effective_user
+        if user is None or user.id not in ADMIN_IDS:
+            q = update.callback_query
+            if q is not None:
+                await q.answer()
+                await q.edit_message_text(_NO_ACCESS_TEXT)
+            else:
+                await update.message.reply_text(_NO_ACCESS_TEXT)
+            return ConversationHandler.END
+        return await fn(update, context)
+
+    return wrapper
 
 
 def _admin_menu_kb() -> InlineKeyboardMarkup:
@@ -27,16 +51,18 @@ def _admin_menu_kb() -> InlineKeyboardMarkup:
 
 def _gen_password(length: int = 6) -> str:
     # 6 xonali raqamli parol (operatorlar uchun qulay)
-    digits = string.digits
-    return "".join(secrets.choice(digits) for _ in range(int(length)))
+    length = int(length)
+    if length > 18:
+        # 8 bayt 10**18 dan kattaroq sonlarni to'liq qoplamaydi
+        return "".join(secrets.choice(string.digits) for _ in range(length))
+    # bitta os.urandom chaqiruvi (secrets.choice har raqamga alohida syscall)
+    n = int.from_bytes(os.urandom(8), "big")
+    return f"{n % 10 ** length:0{length}d}"
 
 
+@admin_only
 async def admin_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not _is_admin(update):
-        await update.message.reply_text("❌ Sizda admin huquqi yo‘q.")
-        return ConversationHandler.END
-
-    total = count_operators()
+    total = await asyncio.to_thread(count_operators)
     await update.message.reply_text(
         f"🛠 Admin panel\n\n👥 Operatorlar soni: {total}",
         reply_markup=_admin_menu_kb(),
@@ -44,12 +70,10 @@ async def admin_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return AD_MENU
 
 
+@admin_only
 async def admin_menu_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    if not _is_admin(update):
-        await q.edit_message_text("❌ Sizda admin huquqi yo‘q.")
-        return ConversationHandler.END
 
     data = (q.data or "").strip()
 
@@ -58,16 +82,16 @@ async def admin_menu_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
 
     if data == "adm:list":
-        ops = list_operators(limit=200)
+        ops, total = await asyncio.to_thread(list_operators_with_total, limit=50)
         if not ops:
             await q.edit_message_text("Hozircha operator yo‘q.", reply_markup=_admin_menu_kb())
             return AD_MENU
 
         lines = ["📋 Operatorlar ro‘yxati (oxirgilari yuqorida):", ""]
-        for o in ops[:50]:
-            lines.append(f"• {o['name']} — {o['phone']} (id:{o['id']})")
-        if len(ops) > 50:
-            lines.append(f"\n… yana {len(ops)-50} ta operator bor.")
+        for o in ops:
+            lines.append(f"• {o.name} — {o.phone} (id:{o.id})")
+        if total > len(ops):
+            lines.append(f"\n… yana {total-len(ops)} ta operator bor.")
         await q.edit_message_text("\n".join(lines), reply_markup=_admin_menu_kb())
         return AD_MENU
 
@@ -83,13 +107,10 @@ async def admin_menu_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return AD_MENU
 
 
+@admin_only
 async def admin_add_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not _is_admin(update):
-        await update.message.reply_text("❌ Sizda admin huquqi yo‘q.")
-        return ConversationHandler.END
-
     phone = (update.message.text or "").strip()
-    phone = re.sub(r"\D+", "", phone)
+    phone = _NON_DIGITS_RE.sub("", phone)
     if len(phone) < 9:
         await update.message.reply_text("❌ Telefon noto‘g‘ri. Namuna: 901234567")
         return AD_ADD_PHONE
@@ -99,11 +120,8 @@ async def admin_add_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return AD_ADD_NAME
 
 
+@admin_only
 async def admin_add_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not _is_admin(update):
-        await update.message.reply_text("❌ Sizda admin huquqi yo‘q.")
-        return ConversationHandler.END
-
     name = (update.message.text or "").strip()
     if not name:
         await update.message.reply_text("❌ Ism bo‘sh bo‘lmasin.")
@@ -118,11 +136,8 @@ async def admin_add_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return AD_ADD_PASS
 
 
+@admin_only
 async def admin_add_pass(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not _is_admin(update):
-        await update.message.reply_text("❌ Sizda admin huquqi yo‘q.")
-        return ConversationHandler.END
-
     pwd = (update.message.text or "").strip()
     if not pwd:
         await update.message.reply_text("❌ Parol bo‘sh bo‘lmasin. AUTO deb yozishingiz ham mumkin.")
@@ -135,7 +150,8 @@ async def admin_add_pass(update: Update, context: ContextTypes.DEFAULT_TYPE):
     phone = (d.get("phone") or "").strip()
     name = (d.get("name") or "").strip()
 
-    ok = create_operator(phone, name, pwd)
+    # sqlite IO event loopni to'xtatmasin
+    ok = await asyncio.to_thread(create_operator, phone, name, pwd)
     if not ok:
         await update.message.reply_text("❌ Bu telefon raqam allaqachon ro‘yxatda. Boshqa raqam kiriting.")
         return AD_ADD_PHONE
@@ -149,7 +165,7 @@ async def admin_add_pass(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Operator botga kirib /login qiladi. Keyin faqat /kiritish va /tasdiq ishlaydi."
     )
     # qaytadan panel
-    total = count_operators()
+    total = await asyncio.to_thread(count_operators)
     await update.message.reply_text(
         f"🛠 Admin panel\n\n👥 Operatorlar soni: {total}",
         reply_markup=_admin_menu_kb(),
@@ -157,21 +173,18 @@ async def admin_add_pass(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return AD_MENU
 
 
+@admin_only
 async def admin_del_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not _is_admin(update):
-        await update.message.reply_text("❌ Sizda admin huquqi yo‘q.")
-        return ConversationHandler.END
-
     phone = (update.message.text or "").strip()
-    phone = re.sub(r"\D+", "", phone)
+    phone = _NON_DIGITS_RE.sub("", phone)
 
-    ok = delete_operator_by_phone(phone)
+    ok = await asyncio.to_thread(delete_operator_by_phone, phone)
     if ok:
         await update.message.reply_text(f"✅ Operator o‘chirildi: {phone}")
     else:
         await update.message.reply_text("❌ Operator topilmadi.")
 
-    total = count_operators()
+    total = await asyncio.to_thread(count_operators)
     await update.message.reply_text(
         f"🛠 Admin panel\n\n👥 Operatorlar soni: {total}",
         reply_markup=_admin_menu_kb(),
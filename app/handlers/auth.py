@@ -1,3 +1,6 @@
+import asyncio
+import functools
+
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import ContextTypes, ConversationHandler
 
@@ -12,6 +15,8 @@ def _clean_phone(text: str) -> str:
     return "".join(ch for ch in (text or "") if ch.isdigit())
 
 
+# APP_MODE o'zgarmaydi: 4 ta (is_logged, is_admin) varianti bir marta quriladi
+@functools.lru_cache(maxsize=None)
 def _menu_keyboard(is_logged: bool = False, is_admin: bool = False) -> ReplyKeyboardMarkup:
     mode = (APP_MODE or "").strip().lower()
 
@@ -108,7 +113,8 @@ async def register_pass(update: Update, context: ContextTypes.DEFAULT_TYPE):
     phone = context.user_data.get("reg_phone", "")
     name = context.user_data.get("reg_name", "")
 
-    ok = create_operator(phone, name, password)
+    # sqlite IO event loopni to'xtatmasin
+    ok = await asyncio.to_thread(create_operator, phone, name, password)
 
     uid = getattr(update.effective_user, "id", None)
     is_admin = uid in ADMIN_IDS
@@ -151,25 +157,22 @@ async def login_pass(update: Update, context: ContextTypes.DEFAULT_TYPE):
     password = (update.message.text or "").strip()
     phone = context.user_data.get("login_phone", "")
 
-    row = check_operator(phone, password)
+    op = await asyncio.to_thread(check_operator, phone, password)
     uid = getattr(update.effective_user, "id", None)
     is_admin = uid in ADMIN_IDS
 
-    if not row:
+    if op is None:
         await update.message.reply_text("❌ Login yoki parol noto‘g‘ri.")
         return LOG_PASS
 
-    context.user_data["operator"] = {
-        "id": row["id"] if hasattr(row, "__getitem__") else row[0],
-        "phone": row["phone"] if hasattr(row, "__getitem__") else row[1],
-        "name": row["name"] if hasattr(row, "__getitem__") else row[2],
-    }
+    # immutable Operator yozuvi: handlerlar op.id / op.name ni to'g'ridan-to'g'ri o'qiydi
+    context.user_data["operator"] = op
 
     mode = (APP_MODE or "").strip().lower()
     if mode == "order":
-        welcome = f"✅ Xush kelibsiz, {context.user_data['operator']['name']}!\nKerakli bo‘limni tanlang: /kiritish."
+        welcome = f"✅ Xush kelibsiz, {op.name}!\nKerakli bo‘limni tanlang: /kiritish."
     else:
-        welcome = f"✅ Xush kelibsiz, {context.user_data['operator']['name']}!\nKerakli bo‘limlarni tanlang: /tasdiq yoki /takror."
+        welcome = f"✅ Xush kelibsiz, {op.name}!\nKerakli bo‘limlarni tanlang: /tasdiq yoki /takror."
 
     await update.message.reply_text(
         welcome,
@@ -1,6 +1,13 @@
 ﻿import os
 import re
+import time
+import asyncio
+import functools
+import hashlib
+import logging
 import copy
+import tempfile
+from dataclasses import dataclass, field
 from pathlib import Path
 from datetime import datetime
 from zoneinfo import ZoneInfo
@@ -9,15 +16,18 @@ from typing import Optional, List, Dict, Any, Tuple
 from telegram import (
     Update,
     Message,
+    CallbackQuery,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
     ReplyKeyboardMarkup,
     KeyboardButton,
 )
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError, TimedOut
 from telegram.ext import ContextTypes, ConversationHandler
 
 from ..config import CONFIRM_CHAT_ID
 from ..db import (
+    ConfirmHeader,
     list_open_confirms,
     search_open_confirms,
     get_confirm,
@@ -25,6 +35,10 @@ from ..db import (
     create_confirm,
 )
 from ..services.moysklad import (
+    MoySkladError,
+    REF_CACHE_TTL,
+    invalidate_reference,
+    refresh_reference_cache,
     get_default_organization,
     get_sales_channels,
     get_product_folders,
@@ -62,13 +76,33 @@ from ..services.moysklad import (
     CF_TIME,
 ) = range(19)
 
+logger = logging.getLogger(__name__)
+
 TMP_DIR = Path(__file__).resolve().parent.parent / "storage" / "tmp"
-TMP_DIR.mkdir(parents=True, exist_ok=True)
+_tmp_ready = False  # TMP_DIR birinchi rasm kelganda yaratiladi
+# shundan eski vaqtinchalik rasmlar fon vazifasida o'chiriladi (sekund)
+TMP_MAX_AGE_SEC = int(os.getenv("CONFIRM_TMP_MAX_AGE", "86400") or "86400")
 
 TG_TZ = ZoneInfo(os.getenv("TG_TZ", "Asia/Tashkent"))
 MS_TZ = ZoneInfo(os.getenv("MOYSKLAD_TZ", "Europe/Moscow"))
 
 GROUPS_PAGE_SIZE = 10
+PICKER_PAGE_SIZE = 8
+
+MS_CONCURRENCY = int(os.getenv("MOYSKLAD_CONCURRENCY", "10") or "10")
+_MS_SEM = asyncio.Semaphore(MS_CONCURRENCY)
+
+# javobsiz qolgan /tasdiq suhbati shuncha sekunddan keyin yopiladi
+CONFIRM_TIMEOUT_SEC = int(os.getenv("CONFIRM_TIMEOUT_SEC", "600") or "600")
+
+# bir xil tugmani qayta bosish shu oraliqda e'tiborsiz qoldiriladi (sekund)
+CALLBACK_DEBOUNCE_SEC = 1.5
+
+# get_or_create_counterparty natijasi (nom, telefon) bo'yicha qisqa muddat
+# eslab qolinadi: qayta urinish / qayta kiritishda MoySklad'ga qayta bormaydi
+CP_CACHE_TTL = 120
+CP_CACHE_MAX = 256
+_CP_CACHE: Dict[tuple, tuple] = {}
 
 ALLOWED_GROUPS = [
     "birka ip",
@@ -86,47 +120,137 @@ ALLOWED_GROUPS = [
 
 CONFIRM_STORE_NAME = "Abusahiy 75"
 
+_NON_DIGITS_RE = re.compile(r"\D+")
+_WS_RE = re.compile(r"\s+")
+_ABBR_NON_LETTERS_RE = re.compile(r"[^a-zа-яёўқғҳ]", re.IGNORECASE)
+# normalizatsiyadan keyingi yagona to'g'ri ko'rinish: +998 va 9 ta raqam
+_PHONE_UZ_RE = re.compile(r"\+998\d{9}")
+_QTY_UNIT_RE = re.compile(r"^\s*(\d[\d\s]*)\s*([a-zA-Zа-яА-ЯёЁ]*)\s*$")
+# forward shablon matnidan avtomatik ajratish
+_INT_RE = re.compile(r"(\d+)")
+_SHT_WORD_RE = re.compile(r"\bsh\b|\bsht\b")
+_KB_WORD_RE = re.compile(r"\bkb\b")
+_FWD_SIZE_RE = re.compile(r"(\d+[\.,]?\d*)\s*[x\*]\s*(\d+[\.,]?\d*)", re.I)
+_FWD_TAG_RE = re.compile(r"(?i)#tasdiq|#takror")
+# razmer: kirill "х" va "*" -> "x", bo'shliqlar olib tashlanadi (lower() dan keyin)
+_SIZE_TRANS = str.maketrans({"х": "x", "*": "x", " ": None})
+_ASCII_DROP_NON_DIGITS = str.maketrans("", "", "".join(chr(c) for c in range(128) if not chr(c).isdigit()))
+
+
+@dataclass(slots=True)
+class ConfirmData:
+    """/tasdiq davomida yig'iladigan bitta buyurtma; batch elementlari ham shu turda."""
+    brand: str = ""
+    client_name: str = ""
+    phone_plus: str = ""
+    counterparty_meta: Dict[str, Any] = field(default_factory=dict)
+
+    image_path: str = ""
+    image_file_id: str = ""
+
+    item_type: str = ""
+    size: str = ""
+    bg_color: str = ""
+    text_color: str = ""
+    qm_note: str = ""
+
+    qty: Optional[int] = None
+    qty_unit_lat: str = ""
+    qty_unit_ru: str = ""
+    price_uzs: Optional[int] = None
+
+    sales_channel_meta: Optional[Dict[str, Any]] = None
+    sales_channel_name: str = ""
+
+    group_meta: Optional[Dict[str, Any]] = None
+    group_name: str = ""
+
+    moment_iso_override: str = ""
+
+
+# buyurtmaning o'ziga tegishli maydonlar: batchga nusxalanadi va keyin tozalanadi
+_ITEM_FIELDS = (
+    "item_type", "size", "bg_color", "text_color", "qm_note",
+    "qty", "qty_unit_lat", "qty_unit_ru", "price_uzs",
+    "sales_channel_meta", "sales_channel_name",
+    "group_meta", "group_name",
+    "image_path", "image_file_id",
+)
+_EMPTY_ITEM = ConfirmData()
+
+
+# Statik klaviaturalar bir marta quriladi (PTB obyektlari immutable),
+# har javobda qayta yaratilmaydi.
+_MENU_KB = ReplyKeyboardMarkup(
+    keyboard=[[KeyboardButton("/tasdiq"), KeyboardButton("/takror")]],
+    resize_keyboard=True,
+    one_time_keyboard=False,
+    selective=True,
+)
+
+_REVIEW_KB = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Tasdiqlash (MoySklad + Kanal)", callback_data="cfr:send")],
+    [InlineKeyboardButton("➕ Buyurtma qo‘shish", callback_data="cfr:add")],
+    [InlineKeyboardButton("🕒 Vaqtni tahrirlash", callback_data="cfr:time")],
+    [InlineKeyboardButton("✏️ Tahrirlash", callback_data="cfr:edit")],
+    [InlineKeyboardButton("⬅️ Orqaga (ro‘yxat)", callback_data="cfr:back")],
+])
+
+_EDIT_CHOOSE_KB = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🏷 B (Brend)", callback_data="cfe:brand")],
+    [InlineKeyboardButton("🧾 M.T (Maxsulot turi)", callback_data="cfe:item")],
+    [InlineKeyboardButton("📏 R (Razmer)", callback_data="cfe:size")],
+    [InlineKeyboardButton("🎨 F (Foni)", callback_data="cfe:bg")],
+    [InlineKeyboardButton("🔤 TI (Text rangi)", callback_data="cfe:text")],
+    [InlineKeyboardButton("📝 Q.M", callback_data="cfe:qm")],
+    [InlineKeyboardButton("🔢 S (Soni)", callback_data="cfe:qty")],
+    [InlineKeyboardButton("📊 KL (Kanal)", callback_data="cfe:channel")],
+    [InlineKeyboardButton("⬅️ Orqaga", callback_data="cfe:back")],
+])
+
+# tahrirlanadigan maydon -> so'rov matni (kalitlar ro'yxati ham shu)
+_EDIT_PROMPTS = {
+    "brand": "🏷 B (Brend) kiriting:",
+    "item": "🧾 M.T (masalan: karton birka):",
+    "size": "📏 R (masalan: 10x5):",
+    "qm": "📝 Q.M (izoh) kiriting:",
+    "qty": "🔢 S (masalan: 3000 yoki 3000 sht/rulon/kg/m/dona):",
+    "channel": "📊 KL ni qayta tanlash uchun OK yozing:",
+}
+
 
 def _menu_keyboard() -> ReplyKeyboardMarkup:
-    return ReplyKeyboardMarkup(
-        keyboard=[[KeyboardButton("/tasdiq"), KeyboardButton("/takror")]],
-        resize_keyboard=True,
-        one_time_keyboard=False,
-        selective=True,
-    )
+    return _MENU_KB
 
 
 def _review_kb(has_batch: bool = False) -> InlineKeyboardMarkup:
-    rows = [
-        [InlineKeyboardButton("✅ Tasdiqlash (MoySklad + Kanal)", callback_data="cfr:send")],
-        [InlineKeyboardButton("➕ Buyurtma qo‘shish", callback_data="cfr:add")],
-        [InlineKeyboardButton("🕒 Vaqtni tahrirlash", callback_data="cfr:time")],
-        [InlineKeyboardButton("✏️ Tahrirlash", callback_data="cfr:edit")],
-        [InlineKeyboardButton("⬅️ Orqaga (ro‘yxat)", callback_data="cfr:back")],
-    ]
-    return InlineKeyboardMarkup(rows)
+    return _REVIEW_KB
 
 
 def _edit_choose_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("🏷 B (Brend)", callback_data="cfe:brand")],
-        [InlineKeyboardButton("🧾 M.T (Maxsulot turi)", callback_data="cfe:item")],
-        [InlineKeyboardButton("📏 R (Razmer)", callback_data="cfe:size")],
-        [InlineKeyboardButton("🎨 F (Foni)", callback_data="cfe:bg")],
-        [InlineKeyboardButton("🔤 TI (Text rangi)", callback_data="cfe:text")],
-        [InlineKeyboardButton("📝 Q.M", callback_data="cfe:qm")],
-        [InlineKeyboardButton("🔢 S (Soni)", callback_data="cfe:qty")],
-        [InlineKeyboardButton("📊 KL (Kanal)", callback_data="cfe:channel")],
-        [InlineKeyboardButton("⬅️ Orqaga", callback_data="cfe:back")],
-    ])
+    return _EDIT_CHOOSE_KB
 
 
 def _digits_only(s: str) -> str:
-    return re.sub(r"\D", "", s or "")
+    if not s:
+        return ""
+    # ASCII matn (deyarli har doim): C darajadagi translate, regex yo'q
+    if s.isascii():
+        # faqat raqamlardan iborat kiritish (eng ko'p uchraydi): nusxasiz qaytadi
+        if s.isdigit():
+            return s
+        return s.translate(_ASCII_DROP_NON_DIGITS)
+    return _NON_DIGITS_RE.sub("", s)
 
 
 def _normalize_phone_uz(phone_raw: str) -> str:
-    digits = _digits_only(phone_raw)
+    # eng ko'p uchraydigan ikki ko'rinish: "901234567" va tayyor "+998901234567"
+    s = (phone_raw or "").strip()
+    if len(s) == 9 and s.isdecimal():
+        return "+998" + s
+    if len(s) == 13 and s.startswith("+998") and s[1:].isdecimal():
+        return s
+    digits = _digits_only(s)
     if not digits:
         return ""
     if len(digits) == 9:
@@ -140,14 +264,21 @@ def _normalize_phone_uz(phone_raw: str) -> str:
     return "+" + digits
 
 
+def _normalize_size(text: str) -> str:
+    return text.lower().translate(_SIZE_TRANS)
+
+
 def _parse_brand_client_phone(text: str):
-    parts = [p.strip() for p in (text or "").strip().split("-", maxsplit=2)]
-    if len(parts) != 3:
+    # "BRAND - Client - phone": ikki marta partition, regex kerak emas
+    brand, sep1, rest = (text or "").partition("-")
+    client, sep2, phone = rest.partition("-")
+    if not sep1 or not sep2:
         return None
-    brand = parts[0].strip().upper()
-    client = parts[1].strip()
-    phone_plus = _normalize_phone_uz(parts[2])
-    if not brand or not client or not phone_plus:
+    brand = brand.strip().upper()
+    client = client.strip()
+    phone_plus = _normalize_phone_uz(phone)
+    # 9 tadan kam raqam yoki 998 siz 12 xonali raqam kontragentga yetib bormasin
+    if not brand or not client or not _PHONE_UZ_RE.fullmatch(phone_plus):
         return None
     return brand, client, phone_plus
 
@@ -158,27 +289,55 @@ def _fmt_int(n: Optional[int]) -> str:
     return f"{n:,}".replace(",", " ")
 
 
+def _item_send_key(
+    confirm_id: int,
+    idx: int,
+    item: ConfirmData,
+    product_name: str,
+    sc_name: str,
+    moment_override: str,
+) -> tuple:
+    # maydon o'zgartirilsa kalit ham o'zgaradi va yangi mahsulot/buyurtma yaratiladi
+    # idx: rasm nomi kontent hashidan, batchdagi bir xil ikki buyurtma adashmasin
+    return (
+        confirm_id,
+        idx,
+        item.image_path,
+        product_name,
+        item.qty,
+        item.qty_unit_ru,
+        item.price_uzs,
+        item.group_name,
+        item.qm_note,
+        sc_name,
+        moment_override,
+    )
+
+
 def _item_abbr3(item_type: str) -> str:
     raw = (item_type or "").strip().lower()
-    letters = re.sub(r"[^a-zа-яёўқғҳ]", "", raw, flags=re.IGNORECASE)
+    letters = _ABBR_NON_LETTERS_RE.sub("", raw)
     if len(letters) >= 3:
         return letters[:3]
-    raw2 = re.sub(r"\s+", "", raw)
+    raw2 = _WS_RE.sub("", raw)
     return (raw2[:3] or "itm").lower()
 
 
 def _norm_group_name(s: str) -> str:
     s = (s or "").strip().lower()
-    s = re.sub(r"\s+", " ", s)
+    s = _WS_RE.sub(" ", s)
     return s
 
 
+_ALLOWED_GROUP_KEYS = frozenset(_norm_group_name(x) for x in ALLOWED_GROUPS)
+
+
 def _parse_qty_and_unit(text: str) -> Tuple[Optional[int], str, str]:
     t = (text or "").strip().lower()
     if not t:
         return None, "", ""
 
-    m = re.match(r"^\s*(\d[\d\s]*)\s*([a-zA-Zа-яА-ЯёЁ]*)\s*$", t)
+    m = _QTY_UNIT_RE.match(t)
     if not m:
         d = _digits_only(t)
         return (int(d) if d else None), "", ""
@@ -205,103 +364,108 @@ def _parse_qty_and_unit(text: str) -> Tuple[Optional[int], str, str]:
 
 
 
-def _normalize_size_text(text: str) -> str:
-    s = (text or "").strip().lower()
-    s = s.replace("??", "x").replace("*", "x").replace(",", ".")
-    s = re.sub(r"\s+", "", s)
-    return s
-
-
 def _normalize_qm_text(text: str) -> str:
     s = (text or "").strip().lower()
     if s == "kb":
         return "kesib buklash"
     return text.strip()
 
-def _ensure_confirm_data(context: ContextTypes.DEFAULT_TYPE):
-    d = context.user_data.get("confirm_data") or {}
-    d.setdefault("brand", "")
-    d.setdefault("client_name", "")
-    d.setdefault("phone_plus", "")
-    d.setdefault("counterparty_meta", {})
-    d.setdefault("image_path", "")
+# /tasdiq oqimi user_data ga yozadigan kalitlar
+_CONFIRM_STATE_KEYS = (
+    "confirm_id", "confirm_data", "cf_channels", "cf_groups", "cf_groups_pages",
+    "cf_open_rows", "edit_key", "cf_cp_rows", "cf_brand_only", "confirm_batch", "cf_sending",
+    "cf_review_parts", "cf_sent_steps", "cf_cb_last",
+)
 
-    d.setdefault("item_type", "")
-    d.setdefault("size", "")
-    d.setdefault("bg_color", "")
-    d.setdefault("text_color", "")
-    d.setdefault("qm_note", "")
 
-    d.setdefault("qty", None)
-    d.setdefault("qty_unit_lat", "")
-    d.setdefault("qty_unit_ru", "")
-    d.setdefault("price_uzs", None)
+def _clear_confirm_state(context: ContextTypes.DEFAULT_TYPE) -> None:
+    for k in _CONFIRM_STATE_KEYS:
+        context.user_data.pop(k, None)
 
-    d.setdefault("sales_channel_meta", None)
-    d.setdefault("sales_channel_name", "")
 
-    d.setdefault("group_meta", None)
-    d.setdefault("group_name", "")
+def _debounced(fn):
+    """
+    Tugmani tez-tez ikki marta bosishni bitta bosishga aylantiradi:
+    oraliq ichida kelgan takror callback javobsiz qoladi, holat o'zgarmaydi.
+    """
+    @functools.wraps(fn)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        q = update.callback_query
+        prefix = (q.data or "").split(":", 1)[0]
+        last = context.user_data.setdefault("cf_cb_last", {})
+        now = time.monotonic()
+        if now - last.get(prefix, 0.0) < CALLBACK_DEBOUNCE_SEC:
+            await q.answer("⏳ Biroz kuting")
+            return None
+        last[prefix] = now
+        return await fn(update, context)
+
+    return wrapper
+
+
+def _ensure_confirm_data(context: ContextTypes.DEFAULT_TYPE) -> ConfirmData:
+    # user_data["confirm_data"] shu yerda bir marta o'rnatiladi; handlerlar
+    # obyektni joyida o'zgartiradi, qayta yozish shart emas
+    d = context.user_data.get("confirm_data")
+    if d is None:
+        d = context.user_data["confirm_data"] = ConfirmData()
+    return d
 
-    d.setdefault("moment_iso_override", "")
 
-    context.user_data["confirm_data"] = d
+def _clone_item_for_batch(d: ConfirmData) -> ConfirmData:
+    return ConfirmData(**{k: copy.deepcopy(getattr(d, k)) for k in _ITEM_FIELDS})
 
 
-def _clone_item_for_batch(d: Dict[str, Any]) -> Dict[str, Any]:
-    keep_keys = [
-        "item_type", "size", "bg_color", "text_color", "qm_note",
-        "qty", "qty_unit_lat", "qty_unit_ru", "price_uzs",
-        "sales_channel_meta", "sales_channel_name",
-        "group_meta", "group_name",
-        "image_path",
-    ]
-    return {k: copy.deepcopy(d.get(k)) for k in keep_keys}
-
-
-def _reset_item_fields_keep_cp_brand(d: Dict[str, Any]) -> Dict[str, Any]:
-    d["image_path"] = ""
-    d["item_type"] = ""
-    d["size"] = ""
-    d["bg_color"] = ""
-    d["text_color"] = ""
-    d["qm_note"] = ""
-    d["qty"] = None
-    d["qty_unit_lat"] = ""
-    d["qty_unit_ru"] = ""
-    d["price_uzs"] = None
-    d["sales_channel_meta"] = None
-    d["sales_channel_name"] = ""
-    d["group_meta"] = None
-    d["group_name"] = ""
+def _reset_item_fields_keep_cp_brand(d: ConfirmData) -> ConfirmData:
+    for k in _ITEM_FIELDS:
+        setattr(d, k, getattr(_EMPTY_ITEM, k))
     return d
 
 
-def _item_is_complete(it: Dict[str, Any]) -> bool:
+def _item_is_complete(it: ConfirmData) -> bool:
     try:
         return (
-            bool(it.get("item_type")) and bool(it.get("size"))
-            and isinstance(it.get("qty"), int) and it.get("qty") > 0
-            and isinstance(it.get("price_uzs"), int) and it.get("price_uzs") > 0
-            and bool(it.get("sales_channel_meta")) and bool(it.get("group_meta"))
-            and bool(it.get("image_path")) and os.path.exists(it.get("image_path"))
+            bool(it.item_type) and bool(it.size)
+            and isinstance(it.qty, int) and it.qty > 0
+            and isinstance(it.price_uzs, int) and it.price_uzs > 0
+            and bool(it.sales_channel_meta) and bool(it.group_meta)
+            and bool(it.image_path) and os.path.exists(it.image_path)
         )
     except Exception:
         return False
 
 
+def _valid_meta(m: Any) -> bool:
+    # MoySklad meta: kamida href va type bo'lishi shart, aks holda POST 400 qaytaradi
+    if isinstance(m, dict) and isinstance(m.get("meta"), dict):
+        m = m["meta"]
+    return isinstance(m, dict) and bool(m.get("href")) and bool(m.get("type"))
+
+
 def _get_locked_batch_channel(context: ContextTypes.DEFAULT_TYPE):
     batch = context.user_data.get("confirm_batch") or []
     if not batch:
         return None, ""
-    first = batch[0] or {}
-    return first.get("sales_channel_meta"), (first.get("sales_channel_name") or "")
+    first = batch[0]
+    return first.sales_channel_meta, (first.sales_channel_name or "")
+
+
+def _find_sale_price_type_meta() -> Optional[Dict[str, Any]]:
+    return (
+        find_price_type_meta_by_name("Цена продажи")
+        or find_price_type_meta_by_name("Розница")
+        or find_price_type_meta_by_name("Опт")
+    )
+
+
+def _ms_moment(dt: datetime) -> str:
+    # isoformat C darajada ishlaydi (strftime locale formatter emas);
+    # [:19] tz suffiksini kesadi — MoySklad "YYYY-MM-DD HH:MM:SS" kutadi
+    return dt.isoformat(sep=" ", timespec="seconds")[:19]
 
 
 def _tg_now_as_ms_moment() -> str:
-    dt_tg = datetime.now(TG_TZ)
-    dt_ms = dt_tg.astimezone(MS_TZ)
-    return dt_ms.strftime("%Y-%m-%d %H:%M:%S")
+    return _ms_moment(datetime.now(MS_TZ))
 
 
 def _fmt_moysklad_moment_for_tg(moment_iso: str) -> str:
@@ -311,7 +475,7 @@ def _fmt_moysklad_moment_for_tg(moment_iso: str) -> str:
     s = (moment_iso or "").strip()
 
     try:
-        dt = datetime.strptime(s[:19], "%Y-%m-%d %H:%M:%S")
+        dt = datetime.fromisoformat(s[:19])
     except Exception:
         return s
 
@@ -319,44 +483,61 @@ def _fmt_moysklad_moment_for_tg(moment_iso: str) -> str:
     return dt.strftime("%d.%m.%Y %H:%M")
 
 
-def _render_review(context: ContextTypes.DEFAULT_TYPE) -> str:
-    d = context.user_data.get("confirm_data") or {}
-    img_ok = bool(d.get("image_path") and os.path.exists(d["image_path"]))
-    img = "BOR ✅" if img_ok else "YO‘Q ❌"
-
-    unit_lat = (d.get("qty_unit_lat") or "").strip()
-    qty_show = _fmt_int(d.get("qty"))
-    if unit_lat:
-        qty_show = f"{qty_show} {unit_lat}"
+def _render_review(context: ContextTypes.DEFAULT_TYPE, cached: bool = False) -> str:
+    """
+    cached=True: maydonlar o'zgarmagan bo'lsa (tahrirdan "Orqaga"), oxirgi
+    renderdagi matn qayta ishlatiladi; vaqt qatori har doim yangidan hisoblanadi.
+    """
+    d = context.user_data.get("confirm_data") or _EMPTY_ITEM
 
-    moment_iso = (d.get("moment_iso_override") or "").strip()
+    moment_iso = (d.moment_iso_override or "").strip()
     if not moment_iso:
         moment_iso = _tg_now_as_ms_moment()
     moment_show = _fmt_moysklad_moment_for_tg(moment_iso) or moment_iso
 
+    parts = context.user_data.get("cf_review_parts") if cached else None
+    if parts is None:
+        parts = _render_review_parts(context, d)
+        context.user_data["cf_review_parts"] = parts
+
+    head, tail = parts
+    return f"{head}🕒 Vaqt: {moment_show}\n{tail}"
+
+
+def _render_review_parts(context: ContextTypes.DEFAULT_TYPE, d: ConfirmData) -> Tuple[str, str]:
+    # image_path faqat rasm diskka yozilgach o'rnatiladi — har renderda stat shart emas
+    img = "BOR ✅" if d.image_path else "YO‘Q ❌"
+
+    unit_lat = (d.qty_unit_lat or "").strip()
+    qty_show = _fmt_int(d.qty)
+    if unit_lat:
+        qty_show = f"{qty_show} {unit_lat}"
+
     batch = context.user_data.get("confirm_batch") or []
     batch_info = f"📦 Batch: {len(batch) + 1} ta buyurtma (yig‘ilmoqda)\n\n" if batch else ""
 
     locked_meta, locked_name = _get_locked_batch_channel(context)
     lock_info = f"🔒 Batch KL: {locked_name}\n" if locked_meta and locked_name else ""
 
-    return (
+    head = (
         f"{batch_info}"
         "🔎 Tekshiruv (Tasdiqlash):\n\n"
-        f"🏷 B: {d.get('brand') or 'N/A'}\n"
-        f"🧾 M.T: {d.get('item_type') or 'N/A'}\n"
-        f"📏 R: {d.get('size') or 'N/A'}\n"
-        f"📝 Q.M: {d.get('qm_note') or '—'}\n"
+        f"🏷 B: {d.brand or 'N/A'}\n"
+        f"🧾 M.T: {d.item_type or 'N/A'}\n"
+        f"📏 R: {d.size or 'N/A'}\n"
+        f"📝 Q.M: {d.qm_note or '—'}\n"
         f"🔢 S: {qty_show}\n"
-        f"💰 Narx: {_fmt_int(d.get('price_uzs'))}\n"
-        f"📊 KL: {d.get('sales_channel_name') or 'N/A'}\n"
+        f"💰 Narx: {_fmt_int(d.price_uzs)}\n"
+        f"📊 KL: {d.sales_channel_name or 'N/A'}\n"
         f"{lock_info}"
-        f"📁 Группа: {d.get('group_name') or 'N/A'}\n"
+        f"📁 Группа: {d.group_name or 'N/A'}\n"
         f"🏬 Sklad: {CONFIRM_STORE_NAME}\n"
-        f"🕒 Vaqt: {moment_show}\n"
+    )
+    tail = (
         f"🖼 Rasm: {img}\n\n"
         "Davom etamizmi?"
     )
+    return head, tail
 
 
 async def on_channel_force(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -374,102 +555,179 @@ async def on_channel_force(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return await _ask_sales_channel(q, context)
 
     d = context.user_data["confirm_data"]
-    d["sales_channel_meta"] = locked_meta
-    d["sales_channel_name"] = locked_name
-    context.user_data["confirm_data"] = d
+    d.sales_channel_meta = locked_meta
+    d.sales_channel_name = locked_name
 
     return await _ask_product_group(q, context, page=0)
 
 
+async def _send_or_edit(target, text: str, *, reply_markup=None):
+    # callback tugmasidan kelgan bo'lsa xabar tahrirlanadi, aks holda yangi javob
+    if isinstance(target, CallbackQuery):
+        return await target.edit_message_text(text, reply_markup=reply_markup)
+    return await target.reply_text(text, reply_markup=reply_markup)
+
+
 async def _ask_sales_channel(update_obj, context: ContextTypes.DEFAULT_TYPE):
-    channels = get_sales_channels(limit=300)
+    channels = await _ms_call(get_sales_channels, limit=300)
     if not channels:
-        msg = "❌ MoySklad’da 'Канал продаж' topilmadi."
-        if hasattr(update_obj, "edit_message_text"):
-            await update_obj.edit_message_text(msg)
-        else:
-            await update_obj.reply_text(msg)
+        await _send_or_edit(update_obj, "❌ MoySklad’da 'Канал продаж' topilmadi.")
         return ConversationHandler.END
 
-    channels = channels[:20]
-    context.user_data["cf_channels_map"] = {str(c["id"]): c for c in channels}
-
-    kb = [[InlineKeyboardButton(c["name"], callback_data=f"cfsc:{c['id']}")] for c in channels]
-    markup = InlineKeyboardMarkup(kb)
+    # faqat (nomi, meta): tugmada ro'yxat indeksi, sahifalash qayta so'rovsiz
+    channels = [(c.get("name") or "", c.get("meta")) for c in channels]
+    context.user_data["cf_channels"] = channels
+    markup = _build_channels_page_markup(channels, 0)
 
     locked_meta, locked_name = _get_locked_batch_channel(context)
     hint = f"\n\n🔒 Batch kanali: {locked_name}" if locked_meta and locked_name else ""
 
-    if hasattr(update_obj, "edit_message_text"):
-        await update_obj.edit_message_text("📊 KL (Kanal) ni tanlang:" + hint, reply_markup=markup)
-    else:
-        await update_obj.reply_text("📊 KL (Kanal) ni tanlang:" + hint, reply_markup=markup)
+    await _send_or_edit(update_obj, "📊 KL (Kanal) ni tanlang:" + hint, reply_markup=markup)
 
     return CF_CHANNEL
 
 
 def _filter_groups(groups: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    allowed = set(_norm_group_name(x) for x in ALLOWED_GROUPS)
-    out: List[Dict[str, Any]] = []
-    for g in groups:
-        name = _norm_group_name(g.get("name") or "")
-        if name in allowed:
-            out.append(g)
-    return out
+    return [g for g in groups if _norm_group_name(g.get("name") or "") in _ALLOWED_GROUP_KEYS]
 
 
-def _build_groups_page_markup(groups: List[Dict[str, Any]], page: int) -> InlineKeyboardMarkup:
-    total = len(groups)
-    max_page = max(0, (total - 1) // GROUPS_PAGE_SIZE)
-    page = max(0, min(page, max_page))
+# (manba ro'yxat, filtrlangan gruppalar, normallashgan nom -> gruppa)
+_GROUPS_MEMO: Optional[tuple] = None
 
-    start = page * GROUPS_PAGE_SIZE
-    chunk = groups[start:start + GROUPS_PAGE_SIZE]
 
-    kb: List[List[InlineKeyboardButton]] = []
-    for g in chunk:
-        kb.append([InlineKeyboardButton(g["name"], callback_data=f"cfg:{g['id']}")])
+def _allowed_groups(folders: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, Dict[str, Any]]]:
+    # get_product_folders keshdan bir xil ro'yxat obyektini qaytaradi: 5000 ta
+    # papka filtri va nom indeksi shu ro'yxat uchun bir marta quriladi
+    global _GROUPS_MEMO
+    memo = _GROUPS_MEMO
+    if memo is not None and memo[0] is folders:
+        return memo[1], memo[2]
 
-    nav: List[InlineKeyboardButton] = []
-    if page > 0:
-        nav.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"cfgp:{page-1}"))
-    nav.append(InlineKeyboardButton(f"{page+1}/{max_page+1}", callback_data="cfgp:noop"))
-    if page < max_page:
-        nav.append(InlineKeyboardButton("Next ➡️", callback_data=f"cfgp:{page+1}"))
+    groups = _filter_groups(folders)
+    by_name: Dict[str, Dict[str, Any]] = {}
+    for g in groups:
+        by_name.setdefault(_norm_group_name(g.get("name") or ""), g)
+    _GROUPS_MEMO = (folders, groups, by_name)
+    return groups, by_name
+
+
+def _build_page_markup(
+    items: List[Any],
+    page: int,
+    page_size: int,
+    make_button,
+    page_prefix: str,
+    head: Optional[List[List[InlineKeyboardButton]]] = None,
+) -> InlineKeyboardMarkup:
+    """
+    Ro'yxatning bitta sahifasi + Prev/Next. Tugmalar faqat shu sahifa uchun
+    yig'iladi; sahifa raqami callback_data ichida (page_prefix:N).
+    """
+    total = len(items)
+    max_page = max(0, (total - 1) // page_size)
+    page = max(0, min(page, max_page))
 
-    if nav:
+    start = page * page_size
+    kb: List[List[InlineKeyboardButton]] = list(head or [])
+    kb += [[make_button(i, x)] for i, x in enumerate(items[start:start + page_size], start)]
+
+    if max_page > 0:
+        nav: List[InlineKeyboardButton] = []
+        if page > 0:
+            nav.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"{page_prefix}:{page-1}"))
+        nav.append(InlineKeyboardButton(f"{page+1}/{max_page+1}", callback_data=f"{page_prefix}:noop"))
+        if page < max_page:
+            nav.append(InlineKeyboardButton("Next ➡️", callback_data=f"{page_prefix}:{page+1}"))
         kb.append(nav)
 
     return InlineKeyboardMarkup(kb)
 
 
+def _parse_page(data: str, page_prefix: str) -> Optional[int]:
+    # "noop" (sahifa raqami tugmasi) uchun None
+    page_s = data.split(f"{page_prefix}:", 1)[-1]
+    if page_s == "noop":
+        return None
+    return int(page_s) if page_s.isdigit() else 0
+
+
+def _pick_by_index(data: str, prefix: str, rows: List[Any]) -> Optional[Any]:
+    # callback_data: "prefix:<ro'yxatdagi indeks>" (UUID emas — qisqa)
+    i_s = data.split(f"{prefix}:", 1)[-1]
+    if not i_s.isdigit():
+        return None
+    i = int(i_s)
+    return rows[i] if i < len(rows) else None
+
+
+def _group_button(i: int, g: Tuple[str, Any]) -> InlineKeyboardButton:
+    return InlineKeyboardButton(g[0], callback_data=f"cfg:{i}")
+
+
+def _channel_button(i: int, c: Tuple[str, Any]) -> InlineKeyboardButton:
+    return InlineKeyboardButton(c[0], callback_data=f"cfsc:{i}")
+
+
+def _btn_title(text: str) -> str:
+    # tugma matni 64 belgigacha; qisqa matn (deyarli har doim) nusxasiz qaytadi
+    return text if len(text) <= 64 else text[:64]
+
+
+def _open_hit_title(r: ConfirmHeader) -> str:
+    return f"✅ {r.brand.strip()} | {r.client_name.strip()} | {r.phone_plus.strip()}".rstrip()
+
+
+def _cp_title(name: str, phone: str) -> str:
+    name = name or "N/A"
+    return f"{name} ({phone})" if phone else name
+
+
+def _open_confirm_button(i: int, r: ConfirmHeader) -> InlineKeyboardButton:
+    return InlineKeyboardButton(_btn_title(f"{r.brand} | {r.phone_plus}".strip()), callback_data=f"cfpick:{r.id}")
+
+
+_PICK_HEAD = [[InlineKeyboardButton("🔎 Qidirish / Yaratish (1 tugma)", callback_data="cfnew:smart")]]
+
+
+def _build_groups_page_markup(groups: List[Tuple[str, Any]], page: int) -> InlineKeyboardMarkup:
+    return _build_page_markup(groups, page, GROUPS_PAGE_SIZE, _group_button, "cfgp")
+
+
+def _groups_page_markup(context: ContextTypes.DEFAULT_TYPE, page: int) -> InlineKeyboardMarkup:
+    # cf_groups tanlov davomida o'zgarmaydi: sahifaga qaytishda tayyor markup
+    # (InlineKeyboardMarkup o'zgarmas obyekt, qayta ishlatish xavfsiz)
+    pages = context.user_data.setdefault("cf_groups_pages", {})
+    markup = pages.get(page)
+    if markup is None:
+        markup = pages[page] = _build_groups_page_markup(context.user_data["cf_groups"], page)
+    return markup
+
+
+def _build_channels_page_markup(channels: List[Tuple[str, Any]], page: int) -> InlineKeyboardMarkup:
+    return _build_page_markup(channels, page, PICKER_PAGE_SIZE, _channel_button, "cfscp")
+
+
+def _build_open_confirms_markup(rows: List[ConfirmHeader], page: int) -> InlineKeyboardMarkup:
+    return _build_page_markup(rows, page, PICKER_PAGE_SIZE, _open_confirm_button, "cfpp", head=_PICK_HEAD)
+
+
 async def _ask_product_group(update_obj, context: ContextTypes.DEFAULT_TYPE, page: int = 0):
-    groups = get_product_folders(limit=5000)
+    groups = await _ms_call(get_product_folders, limit=5000)
     if not groups:
-        msg = "❌ MoySklad’da 'Товары → Группы' topilmadi."
-        if hasattr(update_obj, "edit_message_text"):
-            await update_obj.edit_message_text(msg)
-        else:
-            await update_obj.reply_text(msg)
+        await _send_or_edit(update_obj, "❌ MoySklad’da 'Товары → Группы' topilmadi.")
         return ConversationHandler.END
 
-    groups = _filter_groups(groups)
+    groups, _ = _allowed_groups(groups)
     if not groups:
-        msg = "❌ Siz belgilagan gruppalar MoySklad’da topilmadi (nomlarini tekshiring)."
-        if hasattr(update_obj, "edit_message_text"):
-            await update_obj.edit_message_text(msg)
-        else:
-            await update_obj.reply_text(msg)
+        await _send_or_edit(update_obj, "❌ Siz belgilagan gruppalar MoySklad’da topilmadi (nomlarini tekshiring).")
         return ConversationHandler.END
 
-    context.user_data["cf_groups_all"] = groups
-    markup = _build_groups_page_markup(groups, page)
+    groups = [(g.get("name") or "", g.get("meta")) for g in groups]
+    context.user_data["cf_groups"] = groups
+    context.user_data["cf_groups_pages"] = {}
+    markup = _groups_page_markup(context, page)
 
-    text = f"📁 Группа ni tanlang: (jami: {len(groups)})"
-    if hasattr(update_obj, "edit_message_text"):
-        await update_obj.edit_message_text(text, reply_markup=markup)
-    else:
-        await update_obj.reply_text(text, reply_markup=markup)
+    await _send_or_edit(update_obj, f"📁 Группа ni tanlang: (jami: {len(groups)})", reply_markup=markup)
 
     return CF_GROUP
 
@@ -478,21 +736,15 @@ async def on_groups_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
 
-    data = q.data or ""
-    if data == "cfgp:noop":
+    page = _parse_page(q.data or "", "cfgp")
+    if page is None:
         return CF_GROUP
 
-    page_s = data.split("cfgp:", 1)[-1]
-    try:
-        page = int(page_s)
-    except Exception:
-        page = 0
-
-    groups = context.user_data.get("cf_groups_all") or []
+    groups = context.user_data.get("cf_groups") or []
     if not groups:
         return await _ask_product_group(q, context, page=0)
 
-    markup = _build_groups_page_markup(groups, page)
+    markup = _groups_page_markup(context, page)
     await q.edit_message_text(
         f"📁 Группа ni tanlang: (jami: {len(groups)})",
         reply_markup=markup
@@ -506,29 +758,55 @@ async def tasdiq_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
 
     op = context.user_data["operator"]
-    op_id = int(op.get("id") or 0)
+    op_id = op.id
     if not op_id:
         await update.message.reply_text("❌ Operator ID topilmadi. Qayta /login qiling.", reply_markup=_menu_keyboard())
         return ConversationHandler.END
 
-    rows = list_open_confirms(op_id, limit=50)
+    # kanal/gruppa/sklad spravochniklari parallel, fonda: operator qidirib
+    # turgan paytda yuklanadi (kesh issiq bo'lsa — faqat xotiradan o'qish)
+    context.application.create_task(prewarm_confirm_cache())
 
-    kb = [
-        [InlineKeyboardButton("🔎 Qidirish / Yaratish (1 tugma)", callback_data="cfnew:smart")],
-    ]
-    if rows:
-        for r in rows:
-            title = f"{r.get('brand','')} | {r.get('phone_plus','')}".strip()
-            kb.append([InlineKeyboardButton(title[:64], callback_data=f"cfpick:{r['id']}")])
+    rows = await asyncio.to_thread(list_open_confirms, op_id, limit=50)
+    context.user_data["cf_open_rows"] = rows
 
     await update.message.reply_text(
         "✅ Tasdiqlash: qaysi buyurtmani yuboramiz?\n\n"
         "Yangi tasdiq uchun bitta tugma orqali qidiring yoki format yuboring.",
-        reply_markup=InlineKeyboardMarkup(kb),
+        reply_markup=_build_open_confirms_markup(rows, 0),
     )
     return CF_PICK
 
 
+async def on_pick_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+
+    page = _parse_page(q.data or "", "cfpp")
+    if page is None:
+        return CF_PICK
+
+    rows = context.user_data.get("cf_open_rows") or []
+    await q.edit_message_reply_markup(reply_markup=_build_open_confirms_markup(rows, page))
+    return CF_PICK
+
+
+async def on_channels_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+
+    page = _parse_page(q.data or "", "cfscp")
+    if page is None:
+        return CF_CHANNEL
+
+    channels = context.user_data.get("cf_channels") or []
+    if not channels:
+        return await _ask_sales_channel(q, context)
+
+    await q.edit_message_reply_markup(reply_markup=_build_channels_page_markup(channels, page))
+    return CF_CHANNEL
+
+
 async def on_new_confirm_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
@@ -549,7 +827,7 @@ async def on_cp_search_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
 
     op = context.user_data["operator"]
-    op_id = int(op.get("id") or 0)
+    op_id = op.id
     if not op_id:
         await update.message.reply_text("❌ Operator ID topilmadi. Qayta /login qiling.", reply_markup=_menu_keyboard())
         return ConversationHandler.END
@@ -562,37 +840,28 @@ async def on_cp_search_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     triple = _parse_brand_client_phone(qtxt)
     if triple:
         brand, client_name, phone_plus = triple
-        cp = get_or_create_counterparty(name=client_name, phone=phone_plus)
-        confirm_id = create_confirm(
+        cp = await _get_or_create_cp_cached(client_name, phone_plus)
+        if not cp or not cp.get("meta"):
+            await update.message.reply_text("❌ Kontragent yaratishda xatolik.")
+            return ConversationHandler.END
+        cp_client = (cp.get("name") or client_name).strip()
+        cp_phone = _normalize_phone_uz(cp.get("phone") or phone_plus)
+        confirm_id = await asyncio.to_thread(
+            create_confirm,
             operator_id=op_id,
             brand=brand,
-            client_name=cp.get("name") or client_name,
-            phone_plus=_normalize_phone_uz(cp.get("phone") or phone_plus),
+            client_name=cp_client,
+            phone_plus=cp_phone,
             counterparty_meta=cp.get("meta") or {},
         )
         context.user_data["confirm_id"] = int(confirm_id)
 
-        context.user_data["confirm_data"] = {
-            "brand": brand,
-            "client_name": (cp.get("name") or client_name).strip(),
-            "phone_plus": _normalize_phone_uz(cp.get("phone") or phone_plus),
-            "counterparty_meta": cp.get("meta") or {},
-            "image_path": "",
-            "item_type": "",
-            "size": "",
-            "bg_color": "",
-            "text_color": "",
-            "qm_note": "",
-            "qty": None,
-            "qty_unit_lat": "",
-            "qty_unit_ru": "",
-            "price_uzs": None,
-            "sales_channel_meta": None,
-            "sales_channel_name": "",
-            "group_meta": None,
-            "group_name": "",
-            "moment_iso_override": "",
-        }
+        context.user_data["confirm_data"] = ConfirmData(
+            brand=brand,
+            client_name=cp_client,
+            phone_plus=cp_phone,
+            counterparty_meta=cp.get("meta") or {},
+        )
 
         await update.message.reply_text(
             f"✅ Yangi tasdiq yaratildi: *{brand}*\n\n🖼 Buyurtma rasmini yuboring (Photo yoki File).",
@@ -603,12 +872,12 @@ async def on_cp_search_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data["cf_last_q"] = qtxt
 
     try:
-        open_hits = search_open_confirms(op_id, qtxt, limit=10) or []
+        open_hits = await asyncio.to_thread(search_open_confirms, op_id, qtxt, limit=10) or []
     except Exception:
         open_hits = []
 
     try:
-        rows = search_counterparties(qtxt, limit=20) or []
+        rows = await _ms_call(search_counterparties, qtxt, limit=20) or []
     except Exception as e:
         await update.message.reply_text(f"❌ Qidiruvda xatolik: {e}")
         return CF_CP_SEARCH
@@ -622,29 +891,24 @@ async def on_cp_search_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return CF_CP_SEARCH
 
-    mp: Dict[str, Dict[str, Any]] = {}
-    kb: List[List[InlineKeyboardButton]] = []
-
-    for r in open_hits:
-        cid = int(r.get("id") or 0)
-        if not cid:
-            continue
-        title = f"{(r.get('brand') or '').strip()} | {(r.get('client_name') or '').strip()} | {(r.get('phone_plus') or '').strip()}"
-        kb.append([InlineKeyboardButton(("✅ " + title).strip()[:64], callback_data=f"cfpick:{cid}")])
+    kb: List[List[InlineKeyboardButton]] = [
+        [InlineKeyboardButton(_btn_title(_open_hit_title(r)), callback_data=f"cfpick:{r.id}")]
+        for r in open_hits if r.id
+    ]
 
-    for r in rows:
-        cid = str(r.get("id") or "")
-        if not cid:
-            continue
-        name = (r.get("name") or "").strip() or "N/A"
-        phone = (r.get("phone") or "").strip()
-        title = f"{name} ({phone})" if phone else name
-        mp[cid] = r
-        kb.append([InlineKeyboardButton(title[:64], callback_data=f"cfcp:{cid}")])
+    # faqat tanlashda kerak bo'ladigan maydonlar: (id, nomi, telefon, meta)
+    found: List[Tuple[str, str, str, Dict[str, Any]]] = [
+        (r["id"], (r.get("name") or "").strip(), (r.get("phone") or "").strip(), r.get("meta") or {})
+        for r in rows if r.get("id")
+    ]
+    kb += [
+        [InlineKeyboardButton(_btn_title(_cp_title(name, phone)), callback_data=f"cfcp:{cid}")]
+        for cid, name, phone, _meta in found
+    ]
 
     kb.append([InlineKeyboardButton("➕ Yangi kontragent yaratish", callback_data="cfcp:new")])
 
-    context.user_data["cf_cp_map"] = mp
+    context.user_data["cf_cp_rows"] = found
     await update.message.reply_text(
         "Natijalar:\n"
         "— Agar ✅ OPEN tasdiq chiqsa, o‘shani tanlang.\n"
@@ -668,16 +932,20 @@ async def on_cp_pick(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return CF_CP_SEARCH
 
     cid = data.split("cfcp:", 1)[-1].strip()
-    mp = context.user_data.get("cf_cp_map") or {}
-    cp = mp.get(str(cid))
+    cp = None
+    # ro'yxat 20 tadan oshmaydi: chiziqli qidiruv yetarli
+    for rid, name, phone, meta in context.user_data.get("cf_cp_rows") or []:
+        if rid == cid:
+            cp = {"name": name, "phone": phone, "meta": meta}
+            break
 
     if not cp:
         last_q = (context.user_data.get("cf_last_q") or "").strip()
         if last_q:
             try:
-                rows = search_counterparties(last_q, limit=50) or []
+                rows = await _ms_call(search_counterparties, last_q, limit=50) or []
                 for r in rows:
-                    if str(r.get("id") or "") == str(cid):
+                    if r.get("id") == cid:
                         cp = r
                         break
             except Exception:
@@ -687,27 +955,12 @@ async def on_cp_pick(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await q.edit_message_text("❌ Kontragent topilmadi. Qaytadan qidirib ko‘ring.")
         return CF_CP_SEARCH
 
-    context.user_data["confirm_data"] = {
-        "brand": "",
-        "client_name": (cp.get("name") or "").strip(),
-        "phone_plus": _normalize_phone_uz(cp.get("phone") or ""),
-        "counterparty_meta": cp.get("meta") or {},
-        "image_path": "",
-        "item_type": "",
-        "size": "",
-        "bg_color": "",
-        "text_color": "",
-        "qm_note": "",
-        "qty": None,
-        "qty_unit_lat": "",
-        "qty_unit_ru": "",
-        "price_uzs": None,
-        "sales_channel_meta": None,
-        "sales_channel_name": "",
-        "group_meta": None,
-        "group_name": "",
-        "moment_iso_override": "",
-    }
+    context.user_data["confirm_data"] = ConfirmData(
+        brand="",
+        client_name=(cp.get("name") or "").strip(),
+        phone_plus=_normalize_phone_uz(cp.get("phone") or ""),
+        counterparty_meta=cp.get("meta") or {},
+    )
 
     context.user_data["cf_brand_only"] = True
     await q.edit_message_text("🏷 Brend nomini yozing. Masalan: LEAP")
@@ -720,7 +973,7 @@ async def on_new_confirm_cp(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
 
     op = context.user_data["operator"]
-    op_id = int(op.get("id") or 0)
+    op_id = op.id
     if not op_id:
         await update.message.reply_text("❌ Operator ID topilmadi.")
         return ConversationHandler.END
@@ -733,24 +986,24 @@ async def on_new_confirm_cp(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         _ensure_confirm_data(context)
         d = context.user_data["confirm_data"]
-        d["brand"] = brand
-        context.user_data["confirm_data"] = d
+        d.brand = brand
 
-        if not d.get("counterparty_meta"):
+        if not d.counterparty_meta:
             await update.message.reply_text("❌ Kontragent meta yo‘q. Qaytadan /tasdiq qiling.")
             return ConversationHandler.END
 
-        cid = create_confirm(
+        cid = await asyncio.to_thread(
+            create_confirm,
             operator_id=op_id,
-            brand=d.get("brand") or "",
-            client_name=d.get("client_name") or "",
-            phone_plus=d.get("phone_plus") or "",
-            counterparty_meta=d.get("counterparty_meta") or {},
+            brand=d.brand or "",
+            client_name=d.client_name or "",
+            phone_plus=d.phone_plus or "",
+            counterparty_meta=d.counterparty_meta or {},
         )
 
         context.user_data["confirm_id"] = int(cid)
         context.user_data.pop("cf_brand_only", None)
-        context.user_data.pop("cf_cp_map", None)
+        context.user_data.pop("cf_cp_rows", None)
         context.user_data.pop("confirm_batch", None)
 
         await update.message.reply_text("🖼 Buyurtma rasmini yuboring (Photo yoki File).")
@@ -767,13 +1020,14 @@ async def on_new_confirm_cp(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     brand, client_name, phone_plus = triple
     cp_name = f"{brand} {client_name}".strip()
-    cp = get_or_create_counterparty(name=cp_name, phone=phone_plus)
+    cp = await _get_or_create_cp_cached(cp_name, phone_plus)
 
     if not cp or not cp.get("meta"):
         await update.message.reply_text("❌ Kontragent yaratishda xatolik.")
         return ConversationHandler.END
 
-    cid = create_confirm(
+    cid = await asyncio.to_thread(
+        create_confirm,
         operator_id=op_id,
         brand=brand,
         client_name=client_name,
@@ -782,27 +1036,12 @@ async def on_new_confirm_cp(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
     context.user_data["confirm_id"] = int(cid)
-    context.user_data["confirm_data"] = {
-        "brand": brand,
-        "client_name": client_name,
-        "phone_plus": phone_plus,
-        "counterparty_meta": cp["meta"],
-        "image_path": "",
-        "item_type": "",
-        "size": "",
-        "bg_color": "",
-        "text_color": "",
-        "qm_note": "",
-        "qty": None,
-        "qty_unit_lat": "",
-        "qty_unit_ru": "",
-        "price_uzs": None,
-        "sales_channel_meta": None,
-        "sales_channel_name": "",
-        "group_meta": None,
-        "group_name": "",
-        "moment_iso_override": "",
-    }
+    context.user_data["confirm_data"] = ConfirmData(
+        brand=brand,
+        client_name=client_name,
+        phone_plus=phone_plus,
+        counterparty_meta=cp["meta"],
+    )
 
     context.user_data.pop("confirm_batch", None)
 
@@ -810,41 +1049,27 @@ async def on_new_confirm_cp(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return CF_PHOTO
 
 
+@_debounced
 async def on_pick(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
 
     op = context.user_data["operator"]
-    op_id = int(op.get("id") or 0)
+    op_id = op.id
 
     cid = int((q.data or "").split("cfpick:", 1)[-1])
-    row = get_confirm(op_id, cid)
+    row = await asyncio.to_thread(get_confirm, op_id, cid)
     if not row:
         await q.edit_message_text("❌ Topilmadi yoki sizga tegishli emas.")
         return ConversationHandler.END
 
     context.user_data["confirm_id"] = cid
-    context.user_data["confirm_data"] = {
-        "brand": row.get("brand") or "",
-        "client_name": row.get("client_name") or "",
-        "phone_plus": row.get("phone_plus") or "",
-        "counterparty_meta": row.get("counterparty_meta") or {},
-        "image_path": "",
-        "item_type": "",
-        "size": "",
-        "bg_color": "",
-        "text_color": "",
-        "qm_note": "",
-        "qty": None,
-        "qty_unit_lat": "",
-        "qty_unit_ru": "",
-        "price_uzs": None,
-        "sales_channel_meta": None,
-        "sales_channel_name": "",
-        "group_meta": None,
-        "group_name": "",
-        "moment_iso_override": "",
-    }
+    context.user_data["confirm_data"] = ConfirmData(
+        brand=row.get("brand") or "",
+        client_name=row.get("client_name") or "",
+        phone_plus=row.get("phone_plus") or "",
+        counterparty_meta=row.get("counterparty_meta") or {},
+    )
 
     context.user_data.pop("confirm_batch", None)
 
@@ -852,25 +1077,187 @@ async def on_pick(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return CF_PHOTO
 
 
+def _write_atomic(path: Path, data: bytes) -> None:
+    global _tmp_ready
+    if not _tmp_ready:
+        TMP_DIR.mkdir(parents=True, exist_ok=True)
+        _tmp_ready = True
+    # yarim yozilgan fayl hech qachon image_path bo'lib qolmasin
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def _retrieve_exception(fut: "asyncio.Future") -> None:
+    # natijasi kerak bo'lmay qolgan future: "exception was never retrieved" loglanmasin
+    if not fut.cancelled():
+        fut.exception()
+
+
+async def _ms_call(fn, *args, **kwargs):
+    # MoySklad so'rovlari threadda; bir vaqtda ko'pi bilan MS_CONCURRENCY ta,
+    # operatorlar bir paytda tasdiqlasa rate limit / thread pool to'lib qolmasin
+    async with _MS_SEM:
+        return await asyncio.to_thread(fn, *args, **kwargs)
+
+
+def _forget_cached_cp(cp_meta: Any) -> None:
+    for k in [k for k, v in _CP_CACHE.items() if v[1].get("meta") == cp_meta]:
+        del _CP_CACHE[k]
+
+
+async def _get_or_create_cp_cached(name: str, phone: str) -> Dict[str, Any]:
+    # Kesh urilganda get_or_create_counterparty ichidagi nom/telefon yangilash
+    # (PUT) ataylab o'tkazib yuboriladi: TTL davomida MoySklad'dagi tahrir
+    # ko'rinmasligi mumkin. Har chaqiruvchiga alohida nusxa qaytadi.
+    key = (name.strip().lower(), phone)
+    now = time.monotonic()
+    hit = _CP_CACHE.get(key)
+    if hit is not None and hit[0] > now:
+        return dict(hit[1])
+
+    cp = await _ms_call(get_or_create_counterparty, name=name, phone=phone)
+    # faqat meta bor javob keshlanadi: MoySklad vaqtincha yiqilgani eslanmasin
+    if cp and cp.get("meta"):
+        if len(_CP_CACHE) >= CP_CACHE_MAX:
+            for k in [k for k, v in _CP_CACHE.items() if v[0] <= now]:
+                del _CP_CACHE[k]
+            if len(_CP_CACHE) >= CP_CACHE_MAX:
+                del _CP_CACHE[next(iter(_CP_CACHE))]
+        _CP_CACHE[key] = (now + CP_CACHE_TTL, dict(cp))
+    return cp
+
+
+async def prewarm_confirm_cache() -> None:
+    """
+    /tasdiq ishlatadigan spravochniklarni keshga yuklaydi: bot ishga tushganda
+    va har /tasdiq boshida (argumentlar handlerlardagi bilan bir xil bo'lishi
+    shart — kesh kaliti shu).
+    """
+    results = await asyncio.gather(
+        _ms_call(get_default_organization),
+        _ms_call(get_sales_channels, limit=300),
+        _ms_call(get_product_folders, limit=5000),
+        _ms_call(find_store_meta_by_name, CONFIRM_STORE_NAME),
+        _ms_call(_find_sale_price_type_meta),
+        return_exceptions=True,
+    )
+    for r in results:
+        if isinstance(r, Exception):
+            logger.warning("MoySklad cache prewarm failed: %s", r)
+
+
+# kesh muddati tugashidan oldin yangilanadi: kanal/gruppa tanlash doim xotiradan
+REF_REFRESH_SEC = max(60, REF_CACHE_TTL // 2)
+
+
+async def refresh_reference_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await _ms_call(refresh_reference_cache)
+
+
+async def _tg_retry(make_call, attempts: int = 3):
+    """
+    Telegram chaqiruvi: RetryAfter (flood limit) va vaqtinchalik tarmoq
+    xatolarida kutib qayta urinadi. make_call har urinishda yangi coroutine beradi.
+    TimedOut qayta urinilmaydi: so'rov Telegramga yetib borgan bo'lishi mumkin,
+    qayta yuborish kanalda dublikat post beradi.
+    """
+    for attempt in range(attempts):
+        last = attempt == attempts - 1
+        try:
+            return await make_call()
+        except RetryAfter as e:
+            if last:
+                raise
+            await asyncio.sleep(float(e.retry_after) + 0.5)
+        except BadRequest:
+            # BadRequest ham NetworkError avlodi, lekin qayta urinish foyda bermaydi
+            raise
+        except TimedOut:
+            raise
+        except NetworkError:
+            if last:
+                raise
+            await asyncio.sleep(0.5 * 2 ** attempt)
+
+
+def _read_file_or_none(path: str) -> Optional[bytes]:
+    try:
+        return Path(path).read_bytes()
+    except OSError:
+        return None
+
+
+def _store_image(data: bytes) -> Path:
+    # nom kontent hashidan: bir xil rasm qayta yuborilsa ikkinchi nusxa yozilmaydi
+    path = TMP_DIR / f"{hashlib.blake2b(data, digest_size=16).hexdigest()}.jpg"
+    try:
+        os.utime(path)  # bor fayl: prune uchun yangilangan deb belgilanadi
+    except FileNotFoundError:
+        _write_atomic(path, data)
+    return path
+
+
+async def _download_image(file) -> Path:
+    # download_to_drive faylni event loop ichida sinxron yozadi;
+    # baytlar async olinadi, hash va diskka yozish threadga chiqariladi
+    buf = await file.download_as_bytearray()
+    return await asyncio.to_thread(_store_image, bytes(buf))
+
+
+def _prune_tmp_dir(max_age: float) -> int:
+    cutoff = time.time() - max_age
+    removed = 0
+    try:
+        entries = os.scandir(TMP_DIR)
+    except FileNotFoundError:
+        return 0
+    with entries:
+        for entry in entries:
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+                    removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+async def prune_tmp_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    removed = await asyncio.to_thread(_prune_tmp_dir, TMP_MAX_AGE_SEC)
+    if removed:
+        logger.info("Pruned %s stale image(s) from %s", removed, TMP_DIR)
+
+
 async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = update.message
     _ensure_confirm_data(context)
 
-    img_path = TMP_DIR / f"confirm_{msg.message_id}.jpg"
-
+    # file_id faqat photo uchun: kanalga qayta yuklamasdan shu id bilan yuboriladi
+    # (document file_id ni send_photo qabul qilmaydi)
+    file_id = ""
     if msg.photo:
         file = await msg.photo[-1].get_file()
-        await file.download_to_drive(str(img_path))
+        file_id = msg.photo[-1].file_id
+        img_path = await _download_image(file)
     elif msg.document and (msg.document.mime_type or "").startswith("image/"):
         file = await msg.document.get_file()
-        await file.download_to_drive(str(img_path))
+        img_path = await _download_image(file)
     else:
         await msg.reply_text("❌ Iltimos rasm yuboring (Photo yoki File sifatida rasm).")
         return CF_PHOTO
 
     d = context.user_data["confirm_data"]
-    d["image_path"] = str(img_path)
-    context.user_data["confirm_data"] = d
+    d.image_path = str(img_path)
+    d.image_file_id = file_id
 
     await msg.reply_text("3) 🧾 M.T (Maxsulot turi) yozing. Masalan: karton birka")
     return CF_KIND
@@ -884,8 +1271,7 @@ async def on_kind(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return CF_KIND
 
     d = context.user_data["confirm_data"]
-    d["item_type"] = text
-    context.user_data["confirm_data"] = d
+    d.item_type = text
 
     await update.message.reply_text("4) 📏 R (Razmer) yozing. Masalan: 10x5")
     return CF_SIZE
@@ -894,14 +1280,13 @@ async def on_kind(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def on_size(update: Update, context: ContextTypes.DEFAULT_TYPE):
     _ensure_confirm_data(context)
     text = (update.message.text or "").strip()
-    s = text.lower().replace("х", "x").replace("*", "x").replace(" ", "")
+    s = _normalize_size(text)
     if "x" not in s:
         await update.message.reply_text("❌ Razmer noto‘g‘ri. Masalan: 10x5")
         return CF_SIZE
 
     d = context.user_data["confirm_data"]
-    d["size"] = s
-    context.user_data["confirm_data"] = d
+    d.size = s
 
     await update.message.reply_text("5) 🔤 Qo‘shimcha ma’lumot / izoh kiriting. Masalan: flajok kesib buklash bilan")
     return CF_QM
@@ -919,8 +1304,7 @@ async def on_qm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     _ensure_confirm_data(context)
     val = _normalize_qm_text((update.message.text or "").strip())
     d = context.user_data["confirm_data"]
-    d["qm_note"] = val
-    context.user_data["confirm_data"] = d
+    d.qm_note = val
 
     await update.message.reply_text("6) 🔢 S (Soni) yozing. Masalan: 3000 yoki 3000 sht / 3000 rulon / 3000 kg / 3000 m / 3000 dona")
     return CF_QTY
@@ -938,27 +1322,25 @@ async def on_qty(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return CF_QTY
 
     d = context.user_data["confirm_data"]
-    d["qty"] = int(qty)
-    d["qty_unit_lat"] = unit_lat
-    d["qty_unit_ru"] = unit_ru
-    context.user_data["confirm_data"] = d
+    d.qty = qty
+    d.qty_unit_lat = unit_lat
+    d.qty_unit_ru = unit_ru
 
     return await _ask_sales_channel(update.message, context)
 
 
+@_debounced
 async def on_channel_pick(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     _ensure_confirm_data(context)
 
-    sc_id = (q.data or "").split("cfsc:", 1)[-1]
-    ch = (context.user_data.get("cf_channels_map") or {}).get(str(sc_id))
+    ch = _pick_by_index(q.data or "", "cfsc", context.user_data.get("cf_channels") or [])
     if not ch:
         await q.edit_message_text("❌ Kanal topilmadi. Qaytadan /tasdiq qiling.")
         return ConversationHandler.END
 
-    chosen_meta = ch.get("meta")
-    chosen_name = ch.get("name") or ""
+    chosen_name, chosen_meta = ch
 
     locked_meta, locked_name = _get_locked_batch_channel(context)
     if locked_meta and chosen_meta != locked_meta:
@@ -975,41 +1357,35 @@ async def on_channel_pick(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return CF_CHANNEL
 
+    d = context.user_data["confirm_data"]
     if locked_meta:
-        d = context.user_data["confirm_data"]
-        d["sales_channel_meta"] = locked_meta
-        d["sales_channel_name"] = locked_name
-        context.user_data["confirm_data"] = d
+        d.sales_channel_meta = locked_meta
+        d.sales_channel_name = locked_name
     else:
-        d = context.user_data["confirm_data"]
-        d["sales_channel_meta"] = chosen_meta
-        d["sales_channel_name"] = chosen_name
-        context.user_data["confirm_data"] = d
+        d.sales_channel_meta = chosen_meta
+        d.sales_channel_name = chosen_name
+    # tanlov qilindi: kanallar ro'yxati endi kerak emas
+    context.user_data.pop("cf_channels", None)
 
     return await _ask_product_group(q, context, page=0)
 
 
+@_debounced
 async def on_group_pick(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     _ensure_confirm_data(context)
 
-    gp_id = (q.data or "").split("cfg:", 1)[-1]
-    groups = context.user_data.get("cf_groups_all") or []
-    g = None
-    for it in groups:
-        if str(it.get("id")) == str(gp_id):
-            g = it
-            break
-
+    g = _pick_by_index(q.data or "", "cfg", context.user_data.get("cf_groups") or [])
     if not g:
         await q.edit_message_text("❌ Группа topilmadi. Qaytadan /tasdiq qiling.")
         return ConversationHandler.END
 
     d = context.user_data["confirm_data"]
-    d["group_meta"] = g.get("meta")
-    d["group_name"] = g.get("name") or ""
-    context.user_data["confirm_data"] = d
+    d.group_name, d.group_meta = g
+    # tanlov qilindi: gruppalar ro'yxati endi kerak emas
+    context.user_data.pop("cf_groups", None)
+    context.user_data.pop("cf_groups_pages", None)
 
     await q.edit_message_text("10) 💰 Цена (narx) yozing. Masalan: 450")
     return CF_PRICE
@@ -1028,8 +1404,7 @@ async def on_price(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return CF_PRICE
 
     d = context.user_data["confirm_data"]
-    d["price_uzs"] = price
-    context.user_data["confirm_data"] = d
+    d.price_uzs = price
 
     await update.message.reply_text(
         _render_review(context),
@@ -1044,15 +1419,15 @@ def _parse_forward_total_qty(text: str) -> int:
     total = 0
     for line in (text or "").splitlines():
         low = line.lower()
-        if "dona" in low or re.search(r"\bsh\b|\bsht\b", low):
-            nums = re.findall(r"(\d+)", line)
+        if "dona" in low or _SHT_WORD_RE.search(low):
+            nums = _INT_RE.findall(line)
             if nums:
                 total += int(nums[-1])
     return total
 
 
 def _extract_forward_size(text: str) -> str:
-    m = re.search(r"(\d+[\.,]?\d*)\s*[x\*]\s*(\d+[\.,]?\d*)", text, re.I)
+    m = _FWD_SIZE_RE.search(text)
     if not m:
         return ""
     a = m.group(1).replace(",", ".")
@@ -1064,39 +1439,40 @@ def _build_channel_caption(
     idx: int,
     total: int,
     brand: str,
-    item: Dict[str, Any],
+    item: ConfirmData,
     sc_name: str,
     operator_name: str,
     moment_iso: str,
     order_name: str,
 ) -> str:
-    unit_ru = (item.get("qty_unit_ru") or "").strip()
-    unit_lat = (item.get("qty_unit_lat") or "").strip()
+    unit_ru = (item.qty_unit_ru or "").strip()
+    unit_lat = (item.qty_unit_lat or "").strip()
     unit_show = unit_lat or unit_ru
 
-    qty_show = _fmt_int(item.get("qty"))
+    qty_show = _fmt_int(item.qty)
     if unit_show:
         qty_show = f"{qty_show} {unit_show}"
 
-    qm_show = (item.get("qm_note") or "").strip() or "-"
+    qm_show = (item.qm_note or "").strip() or "-"
     moment_show = _fmt_moysklad_moment_for_tg(moment_iso) or moment_iso
 
     return "\n".join([
         "???? Tekshiruv (Tasdiqlash):",
         "",
         f"???? {brand}",
-        f"???? {item.get('item_type')}",
-        f"???? {item.get('size')}",
+        f"???? {item.item_type}",
+        f"???? {item.size}",
         f"???? {qm_show}",
         f"???? {qty_show}",
-        f"???? {_fmt_int(item.get('price_uzs'))}",
+        f"???? {_fmt_int(item.price_uzs)}",
         f"???? {sc_name}",
-        f"???? {item.get('group_name')}",
+        f"???? {item.group_name}",
         f"???? {CONFIRM_STORE_NAME}",
         f"???? {moment_show}",
         "???? Rasm: BOR ???",
     ])
 
+@_debounced
 async def on_review(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
@@ -1131,7 +1507,7 @@ async def on_review(update: Update, context: ContextTypes.DEFAULT_TYPE):
         batch.append(_clone_item_for_batch(d))
         context.user_data["confirm_batch"] = batch
 
-        context.user_data["confirm_data"] = _reset_item_fields_keep_cp_brand(d)
+        _reset_item_fields_keep_cp_brand(d)
 
         await q.edit_message_text(
             f"✅ Buyurtma batchga qo‘shildi.\n"
@@ -1147,8 +1523,8 @@ async def on_review(update: Update, context: ContextTypes.DEFAULT_TYPE):
     cid = int(context.user_data.get("confirm_id") or 0)
     d = context.user_data["confirm_data"]
 
-    brand = (d.get("brand") or "").strip()
-    cp_meta = d.get("counterparty_meta") or {}
+    brand = (d.brand or "").strip()
+    cp_meta = d.counterparty_meta or {}
     if not brand or not cp_meta:
         await q.edit_message_text("❌ Brend yoki Kontragent topilmadi.")
         return ConversationHandler.END
@@ -1157,11 +1533,11 @@ async def on_review(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await q.edit_message_text("❌ Buyurtma to‘liq emas. Avval hamma maydonlarni to‘ldiring.")
         return ConversationHandler.END
 
-    moment_iso = (d.get("moment_iso_override") or "").strip()
+    moment_iso = (d.moment_iso_override or "").strip()
     if not moment_iso:
         moment_iso = _tg_now_as_ms_moment()
 
-    items: List[Dict[str, Any]] = []
+    items: List[ConfirmData] = []
     batch = context.user_data.get("confirm_batch") or []
     if batch:
         items.extend(batch)
@@ -1172,129 +1548,197 @@ async def on_review(update: Update, context: ContextTypes.DEFAULT_TYPE):
         sc_meta = locked_meta
         sc_name = locked_name
     else:
-        sc_meta = items[-1].get("sales_channel_meta")
-        sc_name = items[-1].get("sales_channel_name") or ""
+        sc_meta = items[-1].sales_channel_meta
+        sc_name = items[-1].sales_channel_name or ""
 
     for it in items:
-        if it.get("sales_channel_meta") != sc_meta:
-            it["sales_channel_meta"] = sc_meta
-            it["sales_channel_name"] = sc_name
-
-    try:
-        org = get_default_organization()
+        if it.sales_channel_meta != sc_meta:
+            it.sales_channel_meta = sc_meta
+            it.sales_channel_name = sc_name
+
+    # meta buzilgan bo'lsa mahsulot yaratilib, buyurtma yiqilib qolmasin:
+    # hech qanday so'rovdan oldin tekshiramiz
+    # faqat buzilgan ma'lumotnoma yozuvi tashlanadi, operatorning batchi saqlanadi
+    stale = []
+    if not _valid_meta(cp_meta):
+        _forget_cached_cp(cp_meta)
+        stale.append("kontragent")
+    if not _valid_meta(sc_meta):
+        invalidate_reference(get_sales_channels, limit=300)
+        stale.append("KL (kanal)")
+    if not all(_valid_meta(it.group_meta) for it in items):
+        invalidate_reference(get_product_folders, limit=5000)
+        stale.append("Группа")
+    if stale:
+        await q.edit_message_text(
+            f"❌ Ma’lumot eskirgan: {', '.join(stale)}.\n"
+            "Tahrirlash orqali qayta tanlang va yana yuboring.",
+            reply_markup=_review_kb(bool(context.user_data.get("confirm_batch"))),
+        )
+        return CF_REVIEW
 
-        store_meta = find_store_meta_by_name(CONFIRM_STORE_NAME)
-        if not store_meta:
-            raise RuntimeError(f"Склад topilmadi: '{CONFIRM_STORE_NAME}'. MoySklad’dagi sklad nomini tekshiring.")
+    # debounce oynasidan keyin bosilgan takroriy "Yuborish" ikkinchi marta
+    # MoySklad buyurtmalarini yaratmasin
+    if context.user_data.get("cf_sending"):
+        return CF_REVIEW
+    context.user_data["cf_sending"] = True
 
-        pt_meta = find_price_type_meta_by_name("Цена продажи")
-        if not pt_meta:
-            pt_meta = find_price_type_meta_by_name("Розница") or find_price_type_meta_by_name("Опт")
+    # bir-biriga bog'liq bo'lmagan so'rovlar parallel, event loop bloklanmaydi
+    prefetch = asyncio.gather(
+        _ms_call(get_default_organization),
+        _ms_call(find_store_meta_by_name, CONFIRM_STORE_NAME),
+        _ms_call(_find_sale_price_type_meta),
+    )
+    # tekshiruvda xato chiqib prefetch kutilmay qolsa ham uning xatosi olinadi
+    prefetch.add_done_callback(_retrieve_exception)
 
+    try:
         created_orders: List[Dict[str, Any]] = []
         total = len(items)
+        # xatodan keyin qayta "Yuborish": muvaffaqiyatli qadamlar takrorlanmaydi
+        sent = context.user_data.setdefault("cf_sent_steps", {})
+        moment_override = (d.moment_iso_override or "").strip()
 
+        prepared = []
         for idx, it in enumerate(items, start=1):
             if not _item_is_complete(it):
                 raise RuntimeError("Batch ichida to‘liq bo‘lmagan buyurtma bor (rasm/maydonlar).")
 
-            unit_ru = (it.get("qty_unit_ru") or "").strip()
-            qty_ru = f"{it.get('qty')}{(' ' + unit_ru) if unit_ru else ''}"
+            unit_ru = (it.qty_unit_ru or "").strip()
+            qty_ru = f"{it.qty}{(' ' + unit_ru) if unit_ru else ''}"
 
             desc = "\n".join([
-                f"[BOT TASDIQLASH] B: {brand} | Operator: {op.get('name')} | Store: {CONFIRM_STORE_NAME}",
+                f"[BOT TASDIQLASH] B: {brand} | Operator: {op.name} | Store: {CONFIRM_STORE_NAME}",
                 f"Item: {idx}/{total}",
-                f"MT:{it.get('item_type')} R:{it.get('size')} QM:{it.get('qm_note') or '-'} S:{qty_ru} Narx:{it.get('price_uzs')} Group:{it.get('group_name')}",
+                f"MT:{it.item_type} R:{it.size} QM:{it.qm_note or '-'} S:{qty_ru} Narx:{it.price_uzs} Group:{it.group_name}",
             ])
 
-            abbr = _item_abbr3(it.get("item_type") or "")
-            product_name = f"{brand} {abbr} {it.get('size')}".strip()
+            abbr = _item_abbr3(it.item_type or "")
+            product_name = f"{brand} {abbr} {it.size}".strip()
+            prepared.append((idx, it, unit_ru, product_name, desc))
 
-            uom_meta = get_or_create_uom_meta(unit_ru) if unit_ru else None
+        org, store_meta, pt_meta = await prefetch
+        if not store_meta:
+            raise RuntimeError(f"Склад topilmadi: '{CONFIRM_STORE_NAME}'. MoySklad’dagi sklad nomini tekshiring.")
 
-            prod = create_product(
-                name=product_name,
-                productfolder_meta=it.get("group_meta"),
-                sale_price_uzs=int(it.get("price_uzs")),
-                price_type_meta=pt_meta,
-                uom_meta=uom_meta,
+        for idx, it, unit_ru, product_name, desc in prepared:
+            done = sent.setdefault(
+                _item_send_key(cid, idx, it, product_name, sc_name, moment_override), {}
             )
 
+            image_path = it.image_path
+            # rasm bir marta o'qiladi: 3 ta attach va kanalga yuborish shu baytlardan.
+            # Disk o'qish mahsulot yaratish so'rovi bilan ustma-ust ketadi
+            image_read = asyncio.ensure_future(asyncio.to_thread(Path(image_path).read_bytes))
+
+            prod = done.get("product")
+            if prod is None:
+                try:
+                    uom_meta = await _ms_call(get_or_create_uom_meta, unit_ru) if unit_ru else None
+                    prod = await _ms_call(
+                        create_product,
+                        name=product_name,
+                        productfolder_meta=it.group_meta,
+                        sale_price_uzs=int(it.price_uzs),
+                        price_type_meta=pt_meta,
+                        uom_meta=uom_meta,
+                    )
+                except BaseException:
+                    image_read.cancel()
+                    raise
+                done["product"] = prod
+
             prod_id = str(prod.get("id") or "")
             prod_meta = prod.get("meta")
-
-            if prod_id:
-                attach_image_to_product(prod_id, it.get("image_path"))
+            image_bytes = await image_read
 
             positions: List[Dict[str, Any]] = []
             if prod_meta:
                 positions.append({
                     "assortment": {"meta": prod_meta},
-                    "quantity": float(int(it.get("qty"))),
-                    "price": int(it.get("price_uzs")) * 100,
+                    "quantity": float(int(it.qty)),
+                    "price": int(it.price_uzs) * 100,
                 })
 
-            order = create_customerorder(
-                organization_meta=org["meta"],
-                agent_meta=cp_meta,
-                sales_channel_meta=sc_meta,
-                store_meta=store_meta,
-                moment_iso=moment_iso,
-                description=desc,
-                positions=positions,
-            )
+            order = done.get("order")
+            if order is None:
+                # mahsulot rasmi va buyurtma yaratish bir-biriga bog'liq emas
+                coros = [_ms_call(
+                    create_customerorder,
+                    organization_meta=org["meta"],
+                    agent_meta=cp_meta,
+                    sales_channel_meta=sc_meta,
+                    store_meta=store_meta,
+                    moment_iso=moment_iso,
+                    description=desc,
+                    positions=positions,
+                )]
+                if prod_id and not done.get("product_image"):
+                    coros.append(_ms_call(attach_image_to_product, prod_id, image_path, image_bytes))
+                order, *_ = await asyncio.gather(*coros, return_exceptions=True)
+                if len(coros) > 1:
+                    done["product_image"] = True
+                if isinstance(order, Exception):
+                    raise order
+                done["order"] = order
             order_id = str(order.get("id") or "")
 
-            if order_id:
-                try:
-                    attach_file_to_customerorder(order_id, it.get("image_path"))
-                except Exception:
-                    pass
-
-                try:
-                    attach_image_to_customerorder(order_id, it.get("image_path"))
-                except Exception:
-                    pass
-
             created_orders.append(order)
 
-            if CONFIRM_CHAT_ID:
-                caption = _build_channel_caption(
-                    idx=idx,
-                    total=total,
-                    brand=brand,
-                    item=it,
-                    sc_name=sc_name,
-                    operator_name=op.get("name"),
-                    moment_iso=moment_iso,
-                    order_name=order.get("name", "N/A"),
-                )
-                with open(it.get("image_path"), "rb") as f:
-                    await context.bot.send_photo(chat_id=CONFIRM_CHAT_ID, photo=f, caption=caption)
-
-        mark_confirm_done(int(op["id"]), cid)
-
-        try:
-            await q.message.delete()
-        except Exception:
-            pass
-
-        await context.bot.send_message(
-            chat_id=q.message.chat_id,
-            text=f"✅ Buyurtma(lar) qabul qilindi. MoySklad’da {len(created_orders)} ta buyurtma yaratildi.",
-            reply_markup=_menu_keyboard(),
+            if not done.get("posted"):
+                # buyurtma fayllari va kanalga post bir-birini kutmaydi
+                tasks = []
+                if order_id and not done.get("order_files"):
+                    # attach_* xatoni o'zi log qiladi va None qaytaradi
+                    tasks.append(_ms_call(attach_file_to_customerorder, order_id, image_path, image_bytes))
+                    tasks.append(_ms_call(attach_image_to_customerorder, order_id, image_path, image_bytes))
+                if CONFIRM_CHAT_ID:
+                    caption = _build_channel_caption(
+                        idx=idx,
+                        total=total,
+                        brand=brand,
+                        item=it,
+                        sc_name=sc_name,
+                        operator_name=op.name,
+                        moment_iso=moment_iso,
+                        order_name=order.get("name", "N/A"),
+                    )
+                    photo = it.image_file_id or image_bytes
+                    tasks.append(_tg_retry(functools.partial(
+                        context.bot.send_photo, chat_id=CONFIRM_CHAT_ID, photo=photo, caption=caption
+                    )))
+                results = await asyncio.gather(*tasks, return_exceptions=True)
+                done["order_files"] = True
+                # kanalga yuborilmasa oldingidek xato bo'lib chiqadi
+                if CONFIRM_CHAT_ID and isinstance(results[-1], Exception):
+                    raise results[-1]
+                done["posted"] = True
+
+        await asyncio.to_thread(mark_confirm_done, op.id, cid)
+
+        # bitta API chaqiruv: tekshiruv xabarining o'zi natijaga almashadi.
+        # Menyu (reply) klaviaturasi /tasdiq davomida olib tashlanmaydi — qayta yuborish shart emas
+        await q.edit_message_text(
+            f"✅ Buyurtma(lar) qabul qilindi. MoySklad’da {len(created_orders)} ta buyurtma yaratildi.\n"
+            + ", ".join(o.get("name", "N/A") for o in created_orders)
         )
 
-    except Exception as e:
-        await q.edit_message_text(f"❌ MoySklad yuborishda xatolik: {e}")
-        return ConversationHandler.END
-
-    for k in (
-        "confirm_id", "confirm_data", "cf_channels_map", "cf_groups_all",
-        "edit_key", "cf_cp_map", "cf_brand_only", "confirm_batch"
-    ):
-        context.user_data.pop(k, None)
+    except (MoySkladError, RuntimeError, TelegramError, OSError) as e:
+        # kutilgan xatolar: tekshiruv ekranida qolamiz, qayta "Yuborish"
+        # yaratilganlarni takrorlamaydi. OSError: vaqtinchalik rasm fayli
+        # (masalan tmp tozalash jobi) yo'qolgan. Boshqalari main.on_error ga traceback bilan
+        await q.edit_message_text(
+            f"❌ MoySklad yuborishda xatolik: {e}\n\n"
+            "Qayta yuborishingiz mumkin — yaratilgan mahsulot/buyurtmalar takrorlanmaydi.",
+            reply_markup=_review_kb(bool(context.user_data.get("confirm_batch"))),
+        )
+        return CF_REVIEW
+    finally:
+        if not prefetch.done():
+            prefetch.cancel()
+        context.user_data.pop("cf_sending", None)
 
+    _clear_confirm_state(context)
     return ConversationHandler.END
 
 
@@ -1306,8 +1750,7 @@ async def on_time_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if txt == "now":
         moment = _tg_now_as_ms_moment()
         d = context.user_data["confirm_data"]
-        d["moment_iso_override"] = moment
-        context.user_data["confirm_data"] = d
+        d.moment_iso_override = moment
 
         await update.message.reply_text(
             _render_review(context),
@@ -1318,8 +1761,7 @@ async def on_time_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         dt = datetime.strptime(txt_raw, "%Y-%m-%d %H:%M")
         dt_tg = dt.replace(tzinfo=TG_TZ)
-        dt_ms = dt_tg.astimezone(MS_TZ)
-        moment = dt_ms.strftime("%Y-%m-%d %H:%M:%S")
+        moment = _ms_moment(dt_tg.astimezone(MS_TZ))
     except Exception:
         await update.message.reply_text(
             "❌ Format noto‘g‘ri.\n"
@@ -1328,8 +1770,7 @@ async def on_time_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return CF_TIME
 
     d = context.user_data["confirm_data"]
-    d["moment_iso_override"] = moment
-    context.user_data["confirm_data"] = d
+    d.moment_iso_override = moment
 
     await update.message.reply_text(
         _render_review(context),
@@ -1338,6 +1779,7 @@ async def on_time_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return CF_REVIEW
 
 
+@_debounced
 async def on_edit_choose(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
@@ -1346,25 +1788,17 @@ async def on_edit_choose(update: Update, context: ContextTypes.DEFAULT_TYPE):
     key = (q.data or "").split("cfe:", 1)[-1]
     if key == "back":
         await q.edit_message_text(
-            _render_review(context),
+            _render_review(context, cached=True),
             reply_markup=_review_kb(bool(context.user_data.get("confirm_batch")))
         )
         return CF_REVIEW
 
-    if key not in ("brand", "item", "size", "qm", "qty", "channel"):
+    prompt = _EDIT_PROMPTS.get(key)
+    if prompt is None:
         return CF_EDIT_CHOOSE
 
     context.user_data["edit_key"] = key
-
-    prompts = {
-        "brand": "🏷 B (Brend) kiriting:",
-        "item": "🧾 M.T (masalan: karton birka):",
-        "size": "📏 R (masalan: 10x5):",
-        "qm": "📝 Q.M (izoh) kiriting:",
-        "qty": "🔢 S (masalan: 3000 yoki 3000 sht/rulon/kg/m/dona):",
-        "channel": "📊 KL ni qayta tanlash uchun OK yozing:",
-    }
-    await q.edit_message_text(prompts[key])
+    await q.edit_message_text(prompt)
     return CF_EDIT_VALUE
 
 
@@ -1382,39 +1816,38 @@ async def on_edit_value(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not val:
             await update.message.reply_text("❌ B bo‘sh bo‘lmasin.")
             return CF_EDIT_VALUE
-        d["brand"] = val.strip().upper()
+        d.brand = val.strip().upper()
 
     elif key == "item":
         if not val:
             await update.message.reply_text("❌ M.T bo‘sh bo‘lmasin.")
             return CF_EDIT_VALUE
-        d["item_type"] = val.strip()
+        d.item_type = val.strip()
 
     elif key == "size":
-        s = val.lower().replace("х", "x").replace("*", "x").replace(" ", "")
+        s = _normalize_size(val)
         if "x" not in s:
             await update.message.reply_text("❌ Razmer noto‘g‘ri. Masalan: 10x5")
             return CF_EDIT_VALUE
-        d["size"] = s
+        d.size = s
 
     elif key == "qm":
-        d["qm_note"] = _normalize_qm_text(val.strip())
+        d.qm_note = _normalize_qm_text(val.strip())
 
     elif key == "qty":
         qty, unit_lat, unit_ru = _parse_qty_and_unit(val)
         if not qty:
             await update.message.reply_text("❌ S noto‘g‘ri. Masalan: 3000 yoki 3000 sht")
             return CF_EDIT_VALUE
-        d["qty"] = int(qty)
-        d["qty_unit_lat"] = unit_lat
-        d["qty_unit_ru"] = unit_ru
+        d.qty = qty
+        d.qty_unit_lat = unit_lat
+        d.qty_unit_ru = unit_ru
 
     elif key == "channel":
         context.user_data.pop("edit_key", None)
         await update.message.reply_text("📊 KL (Kanal) ni tanlaymiz...")
         return await _ask_sales_channel(update.message, context)
 
-    context.user_data["confirm_data"] = d
     context.user_data.pop("edit_key", None)
 
     await update.message.reply_text(
@@ -1424,13 +1857,13 @@ async def on_edit_value(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return CF_REVIEW
 
 
-def _pick_brand_counterparty(brand: str) -> Optional[Dict[str, Any]]:
+async def _pick_brand_counterparty(brand: str) -> Optional[Dict[str, Any]]:
     brand = (brand or "").strip()
     if not brand:
         return None
 
     try:
-        rows = search_counterparties(brand, limit=20) or []
+        rows = await _ms_call(search_counterparties, brand, limit=20) or []
     except Exception:
         return None
 
@@ -1472,7 +1905,7 @@ def _parse_forward_template_line(key: str, value: str, data: Dict[str, Any]) ->
     elif k in ("mt", "m.t", "mahsulot", "mahsulot turi", "maxsulot", "maxsulot turi", "tovar", "item"):
         data["item_type"] = v
     elif k in ("r", "razmer", "size"):
-        data["size"] = v.lower().replace("х", "x").replace("*", "x").replace(" ", "")
+        data["size"] = _normalize_size(v)
     elif k in ("qm", "q.m", "izoh", "comment", "extra"):
         data["qm_note"] = v
     elif k in ("narx", "price"):
@@ -1503,7 +1936,7 @@ def _extract_forward_order_data(caption: str) -> Optional[Dict[str, Any]]:
         return None
 
     tag = "tasdiq" if "#tasdiq" in low_first else "takror"
-    brand = re.sub(r"(?i)#tasdiq|#takror", "", first).strip().upper()
+    brand = _FWD_TAG_RE.sub("", first).strip().upper()
 
     d: Dict[str, Any] = {
         "tag": tag,
@@ -1527,7 +1960,7 @@ def _extract_forward_order_data(caption: str) -> Optional[Dict[str, Any]]:
 
     # avtomatik qm
     low_full = full_text.lower()
-    if "kesib buklash" in low_full or re.search(r"\bkb\b", low_full):
+    if "kesib buklash" in low_full or _KB_WORD_RE.search(low_full):
         d["qm_note"] = "kesib buklash"
 
     # jami qty
@@ -1557,7 +1990,7 @@ def _extract_forward_order_data(caption: str) -> Optional[Dict[str, Any]]:
             continue
 
         if "narx" in low and d["price_uzs"] is None:
-            nums = re.findall(r"(\d+)", line)
+            nums = _INT_RE.findall(line)
             if nums:
                 d["price_uzs"] = int(nums[-1])
                 continue
@@ -1569,8 +2002,8 @@ def _extract_forward_order_data(caption: str) -> Optional[Dict[str, Any]]:
         else:
             d["qm_note"] = add_qm
 
-    brand_cp = _pick_brand_counterparty(d.get("brand") or "")
-    d["brand_counterparty"] = brand_cp or {}
+    # brend kontragenti handlerda (async) qidiriladi: parser tarmoqqa chiqmaydi
+    d["brand_counterparty"] = {}
 
     return d
 
@@ -1640,17 +2073,13 @@ def _forward_review_kb() -> InlineKeyboardMarkup:
 
 
 async def _save_forward_image(msg: Message) -> Optional[str]:
-    img_path = TMP_DIR / f"forward_{msg.message_id}.jpg"
-
     if msg.photo:
         file = await msg.photo[-1].get_file()
-        await file.download_to_drive(str(img_path))
-        return str(img_path)
+        return str(await _download_image(file))
 
     if msg.document and (msg.document.mime_type or "").startswith("image/"):
         file = await msg.document.get_file()
-        await file.download_to_drive(str(img_path))
-        return str(img_path)
+        return str(await _download_image(file))
 
     return None
 
@@ -1673,7 +2102,7 @@ async def on_forward_template_message(update: Update, context: ContextTypes.DEFA
         await msg.reply_text("❌ Forward qilingan xabarda rasm topilmadi.")
         return
 
-    brand_cp = _pick_brand_counterparty(parsed.get("brand") or "")
+    brand_cp = await _pick_brand_counterparty(parsed.get("brand") or "")
 
     context.user_data["forward_order_data"] = {
         **parsed,
@@ -1702,11 +2131,11 @@ async def on_forward_template_text_input(update: Update, context: ContextTypes.D
 
     if field == "brand":
         d["brand"] = text.upper()
-        d["brand_counterparty"] = _pick_brand_counterparty(d.get("brand") or "") or {}
+        d["brand_counterparty"] = await _pick_brand_counterparty(d.get("brand") or "") or {}
     elif field == "item_type":
         d["item_type"] = text
     elif field == "size":
-        d["size"] = text.lower().replace("х", "x").replace("*", "x").replace(" ", "")
+        d["size"] = _normalize_size(text)
     elif field == "qty":
         qty, unit_lat, unit_ru = _parse_qty_and_unit(text)
         if not qty:
@@ -1746,8 +2175,7 @@ async def on_forward_template_text_input(update: Update, context: ContextTypes.D
 
 
 def _pick_forward_group(item_type: str) -> Tuple[Optional[Dict[str, Any]], str]:
-    groups = get_product_folders(limit=5000) or []
-    groups = _filter_groups(groups)
+    groups, by_name = _allowed_groups(get_product_folders(limit=5000) or [])
 
     item = (item_type or "").lower()
 
@@ -1773,12 +2201,7 @@ def _pick_forward_group(item_type: str) -> Tuple[Optional[Dict[str, Any]], str]:
     elif "qolip" in item:
         target_name = "qolip"
 
-    chosen = None
-    if target_name:
-        for g in groups:
-            if _norm_group_name(g.get("name") or "") == _norm_group_name(target_name):
-                chosen = g
-                break
+    chosen = by_name.get(_norm_group_name(target_name)) if target_name else None
 
     if not chosen and groups:
         chosen = groups[0]
@@ -1815,7 +2238,7 @@ async def on_forward_template_action(update: Update, context: ContextTypes.DEFAU
         )
         return
 
-    brand_cp = d.get("brand_counterparty") or _pick_brand_counterparty(d.get("brand") or "") or {}
+    brand_cp = d.get("brand_counterparty") or await _pick_brand_counterparty(d.get("brand") or "") or {}
     if not brand_cp or not brand_cp.get("meta"):
         context.user_data["forward_order_data"] = {**d, "brand_counterparty": {}}
         await q.edit_message_text(
@@ -1824,7 +2247,10 @@ async def on_forward_template_action(update: Update, context: ContextTypes.DEFAU
         )
         return
 
-    op = context.user_data.get("operator") or {}
+    op = context.user_data.get("operator")
+    if op is None:
+        await q.message.reply_text("❌ Avval /login qiling.", reply_markup=_menu_keyboard())
+        return
     image_path = d.get("image_path") or ""
 
     try:
@@ -1834,9 +2260,7 @@ async def on_forward_template_action(update: Update, context: ContextTypes.DEFAU
         if not store_meta:
             raise RuntimeError(f"Склад topilmadi: '{CONFIRM_STORE_NAME}'")
 
-        pt_meta = find_price_type_meta_by_name("Цена продажи")
-        if not pt_meta:
-            pt_meta = find_price_type_meta_by_name("Розница") or find_price_type_meta_by_name("Опт")
+        pt_meta = _find_sale_price_type_meta()
 
         moment_iso = _tg_now_as_ms_moment()
 
@@ -1864,7 +2288,7 @@ async def on_forward_template_action(update: Update, context: ContextTypes.DEFAU
         cp_meta = brand_cp.get("meta")
 
         desc = "\n".join([
-            f"[BOT FORWARD {tag.upper()}] B: {brand} | Operator: {op.get('name')} | Store: {CONFIRM_STORE_NAME}",
+            f"[BOT FORWARD {tag.upper()}] B: {brand} | Operator: {op.name} | Store: {CONFIRM_STORE_NAME}",
             f"MT:{item_type}",
             f"R:{size}",
             f"QM:{qm_note or '-'}",
@@ -1877,6 +2301,8 @@ async def on_forward_template_action(update: Update, context: ContextTypes.DEFAU
         product_name = f"{brand} {abbr} {size}".strip()
 
         uom_meta = get_or_create_uom_meta(qty_unit_ru) if qty_unit_ru else None
+        # rasm bir marta, event loopdan tashqarida o'qiladi
+        image_bytes = await asyncio.to_thread(_read_file_or_none, image_path) if image_path else None
 
         prod = create_product(
             name=product_name,
@@ -1889,9 +2315,9 @@ async def on_forward_template_action(update: Update, context: ContextTypes.DEFAU
         prod_id = str(prod.get("id") or "")
         prod_meta = prod.get("meta")
 
-        if prod_id and image_path and os.path.exists(image_path):
+        if prod_id and image_bytes:
             try:
-                attach_image_to_product(prod_id, image_path)
+                attach_image_to_product(prod_id, image_path, image_bytes)
             except Exception:
                 pass
 
@@ -1914,14 +2340,14 @@ async def on_forward_template_action(update: Update, context: ContextTypes.DEFAU
         )
 
         order_id = str(order.get("id") or "")
-        if order_id and image_path and os.path.exists(image_path):
+        if order_id and image_bytes:
             try:
-                attach_file_to_customerorder(order_id, image_path)
+                attach_file_to_customerorder(order_id, image_path, image_bytes)
             except Exception:
                 pass
 
             try:
-                attach_image_to_customerorder(order_id, image_path)
+                attach_image_to_customerorder(order_id, image_path, image_bytes)
             except Exception:
                 pass
 
@@ -1941,15 +2367,14 @@ async def on_forward_template_action(update: Update, context: ContextTypes.DEFAU
                 f"🔢 {qty_show}",
                 f"📊 KL: {sc_name}",
                 f"📁 Группа: {group_name}",
-                f"👨‍💼 OR: {op.get('name')}",
+                f"👨‍💼 OR: {op.name}",
                 f"🕒 Vaqt: {moment_show}",
                 f"🏬 Sklad: {CONFIRM_STORE_NAME}",
                 f"🧾 MS: {order.get('name', 'N/A')}",
             ])
 
-            if image_path and os.path.exists(image_path):
-                with open(image_path, "rb") as f:
-                    await context.bot.send_photo(chat_id=CONFIRM_CHAT_ID, photo=f, caption=caption)
+            if image_bytes:
+                await context.bot.send_photo(chat_id=CONFIRM_CHAT_ID, photo=image_bytes, caption=caption)
             else:
                 await context.bot.send_message(chat_id=CONFIRM_CHAT_ID, text=caption)
 
@@ -1964,5 +2389,12 @@ async def on_forward_template_action(update: Update, context: ContextTypes.DEFAU
 
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    _clear_confirm_state(context)
     await update.message.reply_text("Bekor qilindi.", reply_markup=_menu_keyboard())
+    return ConversationHandler.END
+
+
+async def on_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # tashlab ketilgan /tasdiq: yig'ilgan ro'yxat va ma'lumotlar xotirada qolmasin
+    _clear_confirm_state(context)
     return ConversationHandler.END
\ No newline at end of file
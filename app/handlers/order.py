@@ -1,6 +1,7 @@
 ﻿# app/handlers/order.py
 import re
 import os
+import asyncio
 from pathlib import Path
 from typing import Optional, Tuple, List, Dict, Any
 from datetime import datetime
@@ -27,7 +28,6 @@ from ..services.moysklad import (
     attach_file_to_paymentin,
     attach_file_to_cashin,
 )
-from ..services.vision import detect_amount_date_time
 
 STEP_PAYTYPE, STEP_CP_SEARCH, STEP_CP_PICK, STEP_AMOUNT_DATE, STEP_CHECK, STEP_CHANNEL, STEP_REVIEW = range(7)
 
@@ -197,6 +197,13 @@ def _fmt_ms_to_tg(date_iso: Optional[str], time_hms: Optional[str]) -> str:
         return raw
 
 
+def _read_bytes_or_none(path: str) -> Optional[bytes]:
+    try:
+        return Path(path).read_bytes()
+    except OSError:
+        return None
+
+
 async def _ask_sales_channel(chat_update_obj, context: ContextTypes.DEFAULT_TYPE):
     channels = get_sales_channels(limit=50)
     if not channels:
@@ -208,7 +215,8 @@ async def _ask_sales_channel(chat_update_obj, context: ContextTypes.DEFAULT_TYPE
         return ConversationHandler.END
 
     channels = channels[:10]
-    context.user_data["channels_map"] = {str(c["id"]): c["meta"] for c in channels}
+    # MoySklad id — UUID satri, callback_data bilan to'g'ridan-to'g'ri solishtiriladi
+    context.user_data["channels_map"] = {c["id"]: c["meta"] for c in channels}
 
     kb = [[InlineKeyboardButton(c["name"], callback_data=f"sc:{c['id']}")] for c in channels]
     markup = InlineKeyboardMarkup(kb)
@@ -651,10 +659,17 @@ async def handle_check_optional(update: Update, context: ContextTypes.DEFAULT_TY
         return STEP_CHECK
 
     file = await msg.photo[-1].get_file()
-    img_path = TMP_DIR / f"check_{msg.message_id}.jpg"
-    await file.download_to_drive(str(img_path))
+    # message_id faqat chat ichida yagona: turli operatorlar cheki bir-birini bosib ketmasin
+    img_path = TMP_DIR / f"check_{msg.chat_id}_{msg.message_id}.jpg"
+    # download_to_drive diskka event loop ichida yozadi — yozish threadda
+    buf = await file.download_as_bytearray()
+    await asyncio.to_thread(img_path.write_bytes, bytes(buf))
     context.user_data["check_path"] = str(img_path)
 
+    # google-cloud-vision (grpc/protobuf) og'ir: faqat chek kelganda yuklanadi,
+    # confirm_bot rejimida umuman import qilinmaydi
+    from ..services.vision import detect_amount_date_time
+
     amount, date_iso, time_hms, raw_text = detect_amount_date_time(str(img_path))
     context.user_data["amount_uzs"] = amount if isinstance(amount, int) else None
     context.user_data["date_iso"] = date_iso
@@ -690,7 +705,7 @@ async def on_sales_channel_chosen(update: Update, context: ContextTypes.DEFAULT_
     await query.answer()
 
     sc_id = (query.data or "").split("sc:", 1)[-1]
-    sc_meta = (context.user_data.get("channels_map") or {}).get(str(sc_id))
+    sc_meta = (context.user_data.get("channels_map") or {}).get(sc_id)
     if not sc_meta:
         await query.edit_message_text("❌ Kanal topilmadi. Qaytadan /kiritish qiling.", reply_markup=None)
         return ConversationHandler.END
@@ -740,14 +755,18 @@ async def on_review_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
     time_hms = context.user_data.get("time_hms")
     sc_meta = context.user_data.get("sales_channel_meta")
     check_path = context.user_data.get("check_path")
-    operator = context.user_data.get("operator", {})
+    operator = context.user_data.get("operator")
+    if not operator:
+        # sessiya yo'qolgan (restart/timeout): qayta login kerak
+        await query.edit_message_text("❌ Avval /login qiling.", reply_markup=None)
+        return ConversationHandler.END
 
     if pt not in ("cash", "card") or not cp.get("meta") or not sc_meta or not isinstance(amount, int) or amount <= 0 or not date_iso:
         await query.edit_message_text("❌ Ma’lumot yetarli emas. Qaytadan /kiritish qiling.", reply_markup=None)
         return ConversationHandler.END
 
     org = get_default_organization()
-    desc = f"Counterparty: {cp.get('name')} | Phone: {cp.get('phone') or ''} | Operator: {operator.get('name')} ({operator.get('phone')})"
+    desc = f"Counterparty: {cp.get('name')} | Phone: {cp.get('phone') or ''} | Operator: {operator.name} ({operator.phone})"
 
     created = None
     doc_kind = "Hujjat"
@@ -780,13 +799,14 @@ async def on_review_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
             attach_file_to_cashin(str(created["id"]), str(check_path))
 
     try:
-        op_id = int(operator.get("id") or 0)
+        op_id = operator.id
         cp_name = (cp.get("name") or "").strip()
         brand, client_name = _infer_brand_client_from_cp_name(cp_name)
         phone_plus = (cp.get("phone") or "").strip()
 
         if op_id and cp.get("meta"):
-            create_confirm_upsert(
+            await asyncio.to_thread(
+                create_confirm_upsert,
                 operator_id=op_id,
                 brand=brand or (cp_name.split(" ", 1)[0] if cp_name else "N/A"),
                 client_name=client_name,
@@ -814,12 +834,12 @@ async def on_review_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"???? {'Naqt' if pt=='cash' else 'Karta'}\n"
             f"???? {_fmt_amount(amount)} UZS\n"
             f"???? {_moment_show}\n"
-            f"??????????? {operator.get('name')} ({operator.get('phone')})\n"
+            f"??????????? {operator.name} ({operator.phone})\n"
             f"???? {doc_kind}"
         )
-        if check_path and os.path.exists(check_path):
-            with open(check_path, "rb") as f:
-                await context.bot.send_photo(chat_id=GROUP_CHAT_ID, photo=f, caption=caption)
+        photo = await asyncio.to_thread(_read_bytes_or_none, check_path) if check_path else None
+        if photo:
+            await context.bot.send_photo(chat_id=GROUP_CHAT_ID, photo=photo, caption=caption)
         else:
             await context.bot.send_message(chat_id=GROUP_CHAT_ID, text=caption)
 
@@ -205,8 +205,7 @@ async def takror_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Avval /login qiling.", reply_markup=_menu_keyboard())
         return ConversationHandler.END
 
-    op = context.user_data.get("operator") or {}
-    op_id = int(op.get("id") or 0)
+    op_id = context.user_data["operator"].id
     latest = get_latest_open_confirm(op_id)
 
     if not latest:
@@ -396,7 +395,10 @@ async def takror_review_action(update: Update, context: ContextTypes.DEFAULT_TYP
         prod = context.user_data.get("tk_product") or {}
         d = context.user_data.get("tk_form") or {}
         confirm_ctx = context.user_data.get("tk_confirm_ctx") or {}
-        operator = context.user_data.get("operator") or {}
+        operator = context.user_data.get("operator")
+        if operator is None:
+            await q.message.reply_text("❌ Avval /login qiling.", reply_markup=_menu_keyboard())
+            return ConversationHandler.END
 
         brand = (d.get("brand") or confirm_ctx.get("brand") or "").strip()
         cp_meta = confirm_ctx.get("counterparty_meta") or {}
@@ -422,7 +424,7 @@ async def takror_review_action(update: Update, context: ContextTypes.DEFAULT_TYP
             }]
 
             desc = "\n".join([
-                f"[BOT TAKROR] B: {brand} | Operator: {operator.get('name')}",
+                f"[BOT TAKROR] B: {brand} | Operator: {operator.name}",
                 f"Product: {d.get('item_type')}",
                 f"Size: {d.get('size')}",
                 f"Qty: {qty}",
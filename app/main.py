@@ -1,6 +1,7 @@
 ﻿import logging
 import sys
 
+from telegram import Update
 from telegram.error import Conflict
 from telegram.ext import (
     Application,
@@ -8,6 +9,7 @@ from telegram.ext import (
     ConversationHandler,
     MessageHandler,
     CallbackQueryHandler,
+    TypeHandler,
     filters,
 )
 
@@ -56,6 +58,7 @@ from .handlers.confirm import (
     on_cp_search_text,
     on_cp_pick as confirm_on_cp_pick,
     on_pick,
+    on_pick_page,
     on_new_confirm_cp,
     on_photo,
     on_kind,
@@ -66,6 +69,7 @@ from .handlers.confirm import (
     on_qty,
     on_channel_pick,
     on_channel_force,
+    on_channels_page,
     on_groups_page,
     on_group_pick,
     on_price,
@@ -76,6 +80,12 @@ from .handlers.confirm import (
     on_forward_template_message,
     on_forward_template_action,
     on_forward_template_text_input,
+    on_timeout as confirm_on_timeout,
+    prune_tmp_job,
+    prewarm_confirm_cache,
+    refresh_reference_job,
+    REF_REFRESH_SEC,
+    CONFIRM_TIMEOUT_SEC,
     CF_PICK,
     CF_NEW_CLICK,
     CF_CP_SEARCH,
@@ -141,10 +151,22 @@ async def on_error(update, context):
     logger.exception("Unhandled exception. update=%s", update, exc_info=context.error)
 
 
+async def on_startup(application: Application) -> None:
+    # MoySklad spravochniklari birinchi /tasdiq dan oldin keshga tushadi
+    await prewarm_confirm_cache()
+
+
 def build_app() -> Application:
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = Application.builder().token(BOT_TOKEN).post_init(on_startup).build()
     application.add_error_handler(on_error)
 
+    if application.job_queue is not None:
+        # eski vaqtinchalik rasmlarni soatiga bir tozalash
+        application.job_queue.run_repeating(prune_tmp_job, interval=3600, first=60)
+        application.job_queue.run_repeating(
+            refresh_reference_job, interval=REF_REFRESH_SEC, first=REF_REFRESH_SEC
+        )
+
     application.add_handler(CommandHandler("start", start))
 
     register_conv = ConversationHandler(
@@ -213,6 +235,7 @@ def build_app() -> Application:
             CF_PICK: [
                 CallbackQueryHandler(on_new_confirm_click, pattern=r"^cfnew:"),
                 CallbackQueryHandler(on_pick, pattern=r"^cfpick:"),
+                CallbackQueryHandler(on_pick_page, pattern=r"^cfpp:"),
             ],
             CF_CP_SEARCH: [MessageHandler(filters.TEXT & ~filters.COMMAND, on_cp_search_text)],
             CF_CP_PICK: [CallbackQueryHandler(confirm_on_cp_pick, pattern=r"^cfcp:")],
@@ -228,6 +251,7 @@ def build_app() -> Application:
             CF_CHANNEL: [
                 CallbackQueryHandler(on_channel_pick, pattern=r"^cfsc:"),
                 CallbackQueryHandler(on_channel_force, pattern=r"^cfscforce:"),
+                CallbackQueryHandler(on_channels_page, pattern=r"^cfscp:"),
             ],
             CF_GROUP: [
                 CallbackQueryHandler(on_groups_page, pattern=r"^cfgp:"),
@@ -238,10 +262,12 @@ def build_app() -> Application:
             CF_TIME: [MessageHandler(filters.TEXT & ~filters.COMMAND, on_time_text)],
             CF_EDIT_CHOOSE: [CallbackQueryHandler(on_edit_choose, pattern=r"^cfe:")],
             CF_EDIT_VALUE: [MessageHandler(filters.TEXT & ~filters.COMMAND, on_edit_value)],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, confirm_on_timeout)],
         },
         fallbacks=[CommandHandler("cancel", cancel_confirm)],
         allow_reentry=True,
         per_message=False,
+        conversation_timeout=CONFIRM_TIMEOUT_SEC,
     )
     application.add_handler(confirm_conv)
 
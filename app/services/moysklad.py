@@ -1,12 +1,19 @@
 # app/services/moysklad.py
 from typing import Any, Dict, Optional, List
 import os
+import time
+import threading
+import functools
 import mimetypes
 import logging
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import base64
 from datetime import datetime
 
+import orjson
+
 from ..config import MOYSKLAD_BASE_URL, MOYSKLAD_TOKEN
 
 TIMEOUT = 20
@@ -17,6 +24,28 @@ class MoySkladError(RuntimeError):
     pass
 
 
+def _make_session() -> requests.Session:
+    # bitta Session: TCP/TLS ulanishlar threadlar orasida qayta ishlatiladi.
+    # Retry faqat idempotent GET/PUT uchun; POST takrorlansa MoySklad'da dublikat
+    # paydo bo'lishi mumkin (ulanish xatosida esa so'rov yuborilmagan — xavfsiz)
+    retry = Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"GET", "PUT"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=20, pool_maxsize=20, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+_SESSION = _make_session()
+
+
 def _headers() -> Dict[str, str]:
     if not MOYSKLAD_TOKEN:
         raise RuntimeError("MOYSKLAD_TOKEN topilmadi. .env / Railway Variables ga MOYSKLAD_TOKEN kiriting.")
@@ -31,6 +60,11 @@ def _url(path: str) -> str:
     return f"{MOYSKLAD_BASE_URL.rstrip('/')}/{path.lstrip('/')}"
 
 
+def _json(r: requests.Response) -> Any:
+    # orjson: bytes dan to'g'ridan-to'g'ri, stdlib json dan bir necha barobar tez
+    return orjson.loads(r.content)
+
+
 def _raise_http_error(e: requests.HTTPError) -> None:
     resp = e.response
     if resp is not None:
@@ -42,33 +76,108 @@ def _raise_http_error(e: requests.HTTPError) -> None:
 
 def ms_get(path: str, params: Optional[Dict[str, Any]] = None):
     try:
-        r = requests.get(_url(path), headers=_headers(), params=params, timeout=TIMEOUT)
+        r = _SESSION.get(_url(path), headers=_headers(), params=params, timeout=TIMEOUT)
         r.raise_for_status()
-        return r.json()
+        return _json(r)
     except requests.HTTPError as e:
         _raise_http_error(e)
+    except requests.RequestException as e:
+        raise MoySkladError(f"MoySklad bilan aloqa xatosi: {e}") from e
 
 
 def ms_post(path: str, payload: Dict[str, Any]):
     try:
-        r = requests.post(_url(path), headers=_headers(), json=payload, timeout=TIMEOUT)
+        r = _SESSION.post(_url(path), headers=_headers(), data=orjson.dumps(payload), timeout=TIMEOUT)
         r.raise_for_status()
-        return r.json()
+        return _json(r)
     except requests.HTTPError as e:
         _raise_http_error(e)
+    except requests.RequestException as e:
+        raise MoySkladError(f"MoySklad bilan aloqa xatosi: {e}") from e
 
 
 def ms_put(path: str, payload: Dict[str, Any]):
     try:
-        r = requests.put(_url(path), headers=_headers(), json=payload, timeout=TIMEOUT)
+        r = _SESSION.put(_url(path), headers=_headers(), data=orjson.dumps(payload), timeout=TIMEOUT)
         r.raise_for_status()
-        return r.json()
+        return _json(r)
     except requests.HTTPError as e:
         _raise_http_error(e)
+    except requests.RequestException as e:
+        raise MoySkladError(f"MoySklad bilan aloqa xatosi: {e}") from e
+
+
+# ================= REFERENCE CACHE =================
+# Ma'lumotnomalar (organization, kanal, gruppa, narx turi, sklad, UOM) soatlab
+# o'zgarmaydi: har tasdiqda qayta so'ralmaydi. Bo'sh javob keshlanmaydi.
+
+REF_CACHE_TTL = int(os.getenv("MOYSKLAD_REF_TTL", "3600") or "3600")
+_REF_CACHE: Dict[tuple, tuple] = {}
+_REF_FNS: Dict[str, Any] = {}
+# kesh sovuq paytda bir kalit uchun faqat bitta thread MoySklad'ga boradi,
+# qolganlari uning natijasini kutadi (bir vaqtda kelgan /tasdiq lar)
+_REF_LOCKS: Dict[tuple, threading.Lock] = {}
+_REF_LOCKS_GUARD = threading.Lock()
+
+
+def _ref_key(fn, args: tuple, kwargs: Dict[str, Any]) -> tuple:
+    return (fn.__name__, args, tuple(sorted(kwargs.items())))
+
+
+def _ref_cached(fn):
+    _REF_FNS[fn.__name__] = fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = _ref_key(fn, args, kwargs)
+        hit = _REF_CACHE.get(key)
+        if hit is not None and hit[0] > time.monotonic():
+            return hit[1]
+
+        with _REF_LOCKS_GUARD:
+            lock = _REF_LOCKS.setdefault(key, threading.Lock())
+        with lock:
+            hit = _REF_CACHE.get(key)
+            if hit is not None and hit[0] > time.monotonic():
+                return hit[1]
+            value = fn(*args, **kwargs)
+            if value:
+                _REF_CACHE[key] = (time.monotonic() + REF_CACHE_TTL, value)
+            return value
+
+    return wrapper
+
+
+def invalidate_reference(fn, *args, **kwargs) -> None:
+    """
+    Bitta kesh yozuvini o'chiradi; argumentlar keshlangan chaqiruvdagi bilan
+    bir xil bo'lishi shart (masalan get_sales_channels, limit=300).
+    """
+    _REF_CACHE.pop(_ref_key(fn, args, kwargs), None)
+
+
+def refresh_reference_cache() -> int:
+    """
+    Keshdagi har bir yozuvni muddati tugamasdan qayta yuklaydi: foydalanuvchi
+    so'rovlari doim keshdan xizmat qiladi. Xato bo'lsa eski qiymat qoladi.
+    """
+    refreshed = 0
+    for key in list(_REF_CACHE):
+        name, args, kwargs = key
+        try:
+            value = _REF_FNS[name](*args, **dict(kwargs))
+        except MoySkladError as e:
+            logger.warning("MoySklad cache refresh failed for %s: %s", name, e)
+            continue
+        if value:
+            _REF_CACHE[key] = (time.monotonic() + REF_CACHE_TTL, value)
+            refreshed += 1
+    return refreshed
 
 
 # ================= BASIC =================
 
+@_ref_cached
 def get_default_organization() -> Dict[str, Any]:
     data = ms_get("/entity/organization", params={"limit": 1})
     if not isinstance(data, dict):
@@ -81,6 +190,7 @@ def get_default_organization() -> Dict[str, Any]:
 
 # ================= SALES CHANNEL =================
 
+@_ref_cached
 def get_sales_channels(limit: int = 50) -> List[Dict[str, Any]]:
     data = ms_get("/entity/saleschannel", params={"limit": limit})
     if not isinstance(data, dict):
@@ -90,6 +200,7 @@ def get_sales_channels(limit: int = 50) -> List[Dict[str, Any]]:
 
 # ================= STORE (Склад) =================
 
+@_ref_cached
 def get_stores(limit: int = 1000) -> List[Dict[str, Any]]:
     data = ms_get("/entity/store", params={"limit": limit})
     if not isinstance(data, dict):
@@ -368,8 +479,29 @@ def create_cashin(
 
 # ================= FILE ATTACH (generic) =================
 
-def _attach_file_generic(entity: str, doc_id: str, file_path: str) -> Optional[Dict[str, Any]]:
-    if not doc_id or not file_path or not os.path.exists(file_path):
+def _read_upload(file_path: str, content: Optional[bytes]) -> Optional[bytes]:
+    """
+    Chaqiruvchi baytlarni bir marta o'qib bergan bo'lsa (content), fayl
+    qayta ochilmaydi. file_path bu holda faqat fayl nomi uchun kerak.
+    """
+    if content is not None:
+        return content
+    if not file_path:
+        return None
+    try:
+        with open(file_path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _attach_file_generic(
+    entity: str,
+    doc_id: str,
+    file_path: str,
+    content: Optional[bytes] = None,
+) -> Optional[Dict[str, Any]]:
+    if not doc_id:
         return None
 
     url = _url(f"/entity/{entity}/{doc_id}/files")
@@ -382,11 +514,13 @@ def _attach_file_generic(entity: str, doc_id: str, file_path: str) -> Optional[D
     headers.pop("Content-Type", None)
 
     try:
-        with open(file_path, "rb") as f:
-            files = {"file": (filename, f, mime)}
-            r = requests.post(url, headers=headers, files=files, timeout=TIMEOUT)
-            r.raise_for_status()
-            return r.json() if r.text else {"ok": True}
+        data = _read_upload(file_path, content)
+        if data is None:
+            return None
+        files = {"file": (filename, data, mime)}
+        r = _SESSION.post(url, headers=headers, files=files, timeout=TIMEOUT)
+        r.raise_for_status()
+        return _json(r) if r.content else {"ok": True}
     except Exception as e:
         logger.warning("File attach failed: entity=%s id=%s file=%s err=%s", entity, doc_id, file_path, e)
         return None
@@ -400,12 +534,17 @@ def attach_file_to_cashin(cashin_id: str, file_path: str) -> Optional[Dict[str,
     return _attach_file_generic("cashin", cashin_id, file_path)
 
 
-def attach_file_to_customerorder(order_id: str, file_path: str) -> Optional[Dict[str, Any]]:
-    return _attach_file_generic("customerorder", order_id, file_path)
+def attach_file_to_customerorder(
+    order_id: str,
+    file_path: str,
+    content: Optional[bytes] = None,
+) -> Optional[Dict[str, Any]]:
+    return _attach_file_generic("customerorder", order_id, file_path, content)
 
 
 # ==================== PRICE TYPES ====================
 
+@_ref_cached
 def get_price_types(limit: int = 100) -> List[Dict[str, Any]]:
     data = ms_get("/context/companysettings/pricetype", params={"limit": limit})
 
@@ -444,6 +583,7 @@ def get_or_create_price_type_meta(name: str) -> Optional[Dict[str, Any]]:
 
 # ==================== PRODUCT FOLDERS ====================
 
+@_ref_cached
 def get_product_folders(limit: int = 50) -> List[Dict[str, Any]]:
     data = ms_get("/entity/productfolder", params={"limit": limit})
     if not isinstance(data, dict):
@@ -453,6 +593,7 @@ def get_product_folders(limit: int = 50) -> List[Dict[str, Any]]:
 
 # ==================== UOM (Единица измерения) ====================
 
+@_ref_cached
 def get_uoms(limit: int = 1000) -> List[Dict[str, Any]]:
     data = ms_get("/entity/uom", params={"limit": limit})
     if not isinstance(data, dict):
@@ -612,13 +753,18 @@ def search_products(query: str, limit: int = 10) -> List[Dict[str, Any]]:
 
 # ==================== PRODUCT IMAGE ====================
 
-def attach_image_to_product(product_id: str, file_path: str) -> Optional[Dict[str, Any]]:
+def attach_image_to_product(
+    product_id: str,
+    file_path: str,
+    content: Optional[bytes] = None,
+) -> Optional[Dict[str, Any]]:
     """
     Product карточкаси -> "Изображения" га расм тушириш.
     1) Avval JSON + base64 (content) bilan yuboramiz.
     2) Agar kerak bo'lsa multipart ham sinaymiz.
     """
-    if not product_id or not file_path or not os.path.exists(file_path):
+    data = _read_upload(file_path, content) if product_id else None
+    if data is None:
         logger.warning("Product image: missing product_id or file not found. product=%s file=%s", product_id, file_path)
         return None
 
@@ -630,13 +776,12 @@ def attach_image_to_product(product_id: str, file_path: str) -> Optional[Dict[st
         filename = filename + ".jpg"
 
     try:
-        with open(file_path, "rb") as f:
-            content_b64 = base64.b64encode(f.read()).decode("utf-8")
+        content_b64 = base64.b64encode(data).decode("utf-8")
 
         payload = {"filename": filename, "content": content_b64}
-        r = requests.post(url, headers=_headers(), json=payload, timeout=TIMEOUT)
+        r = _SESSION.post(url, headers=_headers(), data=orjson.dumps(payload), timeout=TIMEOUT)
         if r.ok:
-            return r.json() if r.text else {"ok": True}
+            return _json(r) if r.content else {"ok": True}
 
         logger.warning("Product image JSON upload HTTP %s url=%s body=%s", r.status_code, url, r.text[:2000])
     except Exception as e:
@@ -649,12 +794,11 @@ def attach_image_to_product(product_id: str, file_path: str) -> Optional[Dict[st
         headers = _headers().copy()
         headers.pop("Content-Type", None)
 
-        with open(file_path, "rb") as f:
-            files = {"file": (filename, f, mime)}
-            r2 = requests.post(url, headers=headers, files=files, timeout=TIMEOUT)
+        files = {"file": (filename, data, mime)}
+        r2 = _SESSION.post(url, headers=headers, files=files, timeout=TIMEOUT)
 
         if r2.ok:
-            return r2.json() if r2.text else {"ok": True}
+            return _json(r2) if r2.content else {"ok": True}
 
         logger.warning("Product image multipart upload HTTP %s url=%s body=%s", r2.status_code, url, r2.text[:2000])
     except Exception as e:
@@ -665,8 +809,13 @@ def attach_image_to_product(product_id: str, file_path: str) -> Optional[Dict[st
 
 # ==================== CUSTOMER ORDER IMAGE ====================
 
-def attach_image_to_customerorder(order_id: str, file_path: str) -> Optional[Dict[str, Any]]:
-    if not order_id or not file_path or not os.path.exists(file_path):
+def attach_image_to_customerorder(
+    order_id: str,
+    file_path: str,
+    content: Optional[bytes] = None,
+) -> Optional[Dict[str, Any]]:
+    data = _read_upload(file_path, content) if order_id else None
+    if data is None:
         logger.warning("Order image: missing order_id or file not found. order=%s file=%s", order_id, file_path)
         return None
 
@@ -680,9 +829,8 @@ def attach_image_to_customerorder(order_id: str, file_path: str) -> Optional[Dic
 
     def _try(field_name: str) -> Optional[Dict[str, Any]]:
         try:
-            with open(file_path, "rb") as f:
-                files = {field_name: (filename, f, mime)}
-                r = requests.post(url, headers=headers, files=files, timeout=TIMEOUT)
+            files = {field_name: (filename, data, mime)}
+            r = _SESSION.post(url, headers=headers, files=files, timeout=TIMEOUT)
 
             if not r.ok:
                 logger.warning(
@@ -691,7 +839,7 @@ def attach_image_to_customerorder(order_id: str, file_path: str) -> Optional[Dic
                 )
                 return None
 
-            return r.json() if r.text else {"ok": True}
+            return _json(r) if r.content else {"ok": True}
         except Exception as e:
             logger.warning("Order image upload failed: field=%s order=%s file=%s err=%s", field_name, order_id, file_path, e)
             return None